@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+# Sample x CNVR encoded genotype matrix written by step5.encode_cnvr.py.
+#
+# The matrix is stored as a compressed sparse int8 matrix (<prefix>.npz, rows are
+# samples, columns CNVRs; -1 loss, 1 gain, 0 normal or not called) together with
+# two index files giving the row and column order:
+#     <prefix>_samples.txt   Sample_ID, one per matrix row
+#     <prefix>_cnvrs.txt     CNVR_ID, one per matrix column
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+def matrix_paths(prefix):
+    return f"{prefix}.npz", f"{prefix}_samples.txt", f"{prefix}_cnvrs.txt"
+
+def save_encoded_matrix(prefix, matrix, sample_ids, cnvr_ids):
+    matrix_path, samples_path, cnvrs_path = matrix_paths(prefix)
+    matrix = sparse.csr_matrix(matrix, dtype=np.int8)
+    matrix.eliminate_zeros()
+    sparse.save_npz(matrix_path, matrix, compressed=True)
+    pd.DataFrame({'Sample_ID': sample_ids}).to_csv(samples_path, sep='\t', index=False)
+    pd.DataFrame({'CNVR_ID': cnvr_ids}).to_csv(cnvrs_path, sep='\t', index=False)
+
+def load_encoded_matrix(prefix):
+    # Returns (CSR int8 matrix, sample IDs, CNVR IDs)
+    matrix_path, samples_path, cnvrs_path = matrix_paths(prefix)
+    matrix = sparse.load_npz(matrix_path).tocsr()
+    sample_ids = pd.read_csv(samples_path, sep='\t', dtype=str, keep_default_na=False)['Sample_ID'].tolist()
+    cnvr_ids = pd.read_csv(cnvrs_path, sep='\t', dtype=str, keep_default_na=False)['CNVR_ID'].tolist()
+    return matrix, sample_ids, cnvr_ids
+
+def to_long(matrix, sample_ids, cnvr_ids):
+    # Long table with one line per sample x CNVR cell (zeros included), sample by sample
+    values = np.asarray(matrix.todense(), dtype=np.int8)
+    return pd.DataFrame({'Sample_ID': np.repeat(np.asarray(sample_ids, dtype=object), len(cnvr_ids)),
+                         'CNVR_ID': np.tile(np.asarray(cnvr_ids, dtype=object), len(sample_ids)),
+                         'Encoded_Value': values.ravel()})
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+# Columnar on-disk cache of an Illumina GenomeStudio final report.
+#
+# A cache is a directory holding one raw binary file per column plus meta.json,
+# which keeps the [Header] block, the column order, the dtype of every column
+# and the labels behind the integer-coded columns. Columns can be memory-mapped
+# one at a time, so a stage only pays for the columns it actually uses.
+#
+# Build a cache once with:
+#     python final_report_cache.py <final_report> <cache_dir>
+# and pass <cache_dir> to any script that accepts a final report.
+
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+META_FILE = 'meta.json'
+
+# Number of [Data] rows parsed per chunk while building a cache
+DEFAULT_CHUNK_ROWS = 2_000_000
+
+# Intensity columns are stored as float32
+FLOAT_COLUMNS = {'Log R Ratio', 'B Allele Freq', 'GC Score', 'GT Score', 'X', 'Y', 'X Raw', 'Y Raw', 'R', 'Theta'}
+
+# Coordinate columns are stored as int32
+INT_COLUMNS = {'Position'}
+
+# Small vocabularies (alleles, chromosomes) are coded as int8, everything else
+# (sample and SNP names) as int32; -1 marks a missing value
+SMALL_CODED_COLUMNS = {'Chr', 'Chromosome', 'Allele1 - Top', 'Allele2 - Top', 'Allele1 - AB', 'Allele2 - AB',
+                       'Allele1 - Forward', 'Allele2 - Forward', 'Allele1 - Design', 'Allele2 - Design'}
+
+def column_dtype(column):
+    if column in FLOAT_COLUMNS:
+        return 'float32'
+    if column in INT_COLUMNS:
+        return 'int32'
+    if column in SMALL_CODED_COLUMNS:
+        return 'int8'
+    return 'int32'
+
+def is_coded(column):
+    return column not in FLOAT_COLUMNS and column not in INT_COLUMNS
+
+def column_file(column):
+    return column.replace(' ', '_').replace('/', '_') + '.bin'
+
+def is_cache(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_FILE))
+
+def read_text_header(report_path):
+    # Return the header lines up to and including [Data]
+    header_lines = []
+    with open(report_path, 'r') as file:
+        for line in file:
+            header_lines.append(line)
+            if line.startswith('[Data]'):
+                return header_lines
+    raise ValueError(f"No [Data] section found in {report_path}")
+
+def read_meta(cache_dir):
+    with open(os.path.join(cache_dir, META_FILE), 'r') as file:
+        return json.load(file)
+
+def read_header(path):
+    # Header lines of either a text final report or a cache
+    if is_cache(path):
+        return read_meta(path)['header']
+    return read_text_header(path)
+
+def build_cache(report_path, cache_dir, chunk_rows=DEFAULT_CHUNK_ROWS):
+    header_lines = read_text_header(report_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    columns = None
+    levels = {}
+    lookups = {}
+    handles = {}
+    n_rows = 0
+
+    try:
+        # Every column is read as text so that IDs such as 'NA' survive; numbers are converted per column
+        reader = pd.read_csv(report_path, sep='\t', skiprows=len(header_lines), dtype=str,
+                             keep_default_na=False, chunksize=chunk_rows)
+        for chunk in reader:
+            if columns is None:
+                columns = list(chunk.columns)
+                for column in columns:
+                    handles[column] = open(os.path.join(cache_dir, column_file(column)), 'wb')
+                    if is_coded(column):
+                        levels[column] = []
+                        lookups[column] = {}
+
+            for column in columns:
+                values = chunk[column]
+                dtype = column_dtype(column)
+                if is_coded(column):
+                    # Extend the vocabulary with labels first seen in this chunk, then code the chunk in one go
+                    lookup = lookups[column]
+                    for label in pd.unique(values):
+                        if label not in lookup and label != '':
+                            lookup[label] = len(levels[column])
+                            levels[column].append(label)
+                    if len(levels[column]) > np.iinfo(dtype).max:
+                        raise ValueError(f"Column '{column}' has too many distinct values for {dtype} codes")
+                    data = pd.Index(levels[column]).get_indexer(values).astype(dtype)
+                else:
+                    data = pd.to_numeric(values.replace('', np.nan), errors='coerce').to_numpy()
+                    if dtype == 'int32':
+                        if np.isnan(data).any():
+                            raise ValueError(f"Column '{column}' contains missing values")
+                        data = data.astype('int64')
+                    data = data.astype(dtype)
+                data.tofile(handles[column])
+            n_rows += len(chunk)
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    if columns is None:
+        raise ValueError(f"No [Data] rows found in {report_path}")
+
+    meta = {
+        'source': os.path.abspath(report_path),
+        'header': header_lines,
+        'n_rows': n_rows,
+        'columns': [{'name': column,
+                     'file': column_file(column),
+                     'dtype': column_dtype(column),
+                     'levels': levels.get(column)} for column in columns],
+    }
+    with open(os.path.join(cache_dir, META_FILE), 'w') as file:
+        json.dump(meta, file)
+
+    print(f"Columnar cache of {n_rows} rows and {len(columns)} columns saved to {cache_dir}")
+    return meta
+
+def column_info(meta, column):
+    for info in meta['columns']:
+        if info['name'] == column:
+            return info
+    raise KeyError(f"Column '{column}' not found in final report cache")
+
+def open_column(cache_dir, column, meta=None):
+    # Memory-map one column; coded columns come back as (codes, levels)
+    meta = meta or read_meta(cache_dir)
+    info = column_info(meta, column)
+    data = np.memmap(os.path.join(cache_dir, info['file']), dtype=info['dtype'], mode='r', shape=(meta['n_rows'],))
+    if info['levels'] is not None:
+        return data, info['levels']
+    return data
+
+def column_to_series(cache_dir, column, meta=None, rows=slice(None)):
+    meta = meta or read_meta(cache_dir)
+    data = open_column(cache_dir, column, meta)
+    if isinstance(data, tuple):
+        # Labels are stored in order of first appearance; recode them in sorted order
+        # so that sorting the categorical gives the same result as sorting the strings
+        codes, labels = data
+        order = np.argsort(np.array(labels, dtype=object))
+        rank = np.empty(len(labels) + 1, dtype=codes.dtype)
+        rank[order] = np.arange(len(labels))
+        rank[-1] = -1  # missing values (code -1) stay missing
+        sorted_labels = [labels[i] for i in order]
+        return pd.Series(pd.Categorical.from_codes(rank[np.asarray(codes[rows])], categories=sorted_labels), name=column)
+    return pd.Series(np.asarray(data[rows]), name=column)
+
+def read_cache(cache_dir, columns=None, rows=slice(None)):
+    meta = read_meta(cache_dir)
+    columns = columns or [info['name'] for info in meta['columns']]
+    return pd.DataFrame({column: column_to_series(cache_dir, column, meta, rows) for column in columns})
+
+def label_lookup(levels, labels):
+    # Boolean lookup indexed by code: True where the level is in `labels`
+    # (the trailing False is picked up by the missing code -1)
+    return np.array([level in labels for level in levels] + [False])
+
+def write_text_report(cache_dir, output_file, header_lines, row_mask=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    # Write a cache back out as a tab-delimited final report, chunk by chunk.
+    # row_mask(rows) returns a boolean array selecting the rows of that slice to keep.
+    meta = read_meta(cache_dir)
+    columns = [info['name'] for info in meta['columns']]
+    with open(output_file, 'w') as file:
+        file.writelines(header_lines)
+        file.write('\t'.join(columns) + '\n')
+        for start in range(0, meta['n_rows'], chunk_rows):
+            rows = slice(start, min(start + chunk_rows, meta['n_rows']))
+            chunk = read_cache(cache_dir, columns, rows)
+            if row_mask is not None:
+                chunk = chunk[row_mask(rows)]
+            chunk.to_csv(file, sep='\t', index=False, header=False, na_rep='NaN')
+
+def read_final_report(path, columns=None, dtype=None):
+    # Read the [Data] section of a text final report or a cache into a DataFrame;
+    # dtype is passed on to pandas for text reports (cached columns already have compact types)
+    if is_cache(path):
+        return read_cache(path, columns)
+    header_lines = read_text_header(path)
+    return pd.read_csv(path, sep='\t', skiprows=len(header_lines), usecols=columns, dtype=dtype)
+
+def iter_final_report(path, columns=None, dtype=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    # Same as read_final_report, but yields the [Data] rows in chunks of at most chunk_rows, in file order
+    if is_cache(path):
+        meta = read_meta(path)
+        for start in range(0, meta['n_rows'], chunk_rows):
+            yield read_cache(path, columns, slice(start, min(start + chunk_rows, meta['n_rows'])))
+        return
+    header_lines = read_text_header(path)
+    yield from pd.read_csv(path, sep='\t', skiprows=len(header_lines), usecols=columns, dtype=dtype,
+                           chunksize=chunk_rows)
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a final report into a columnar binary cache.')
+    parser.add_argument('report_path', type=str, help='Path to the tab-delimited final report')
+    parser.add_argument('cache_dir', type=str, help='Directory to write the cache into')
+    parser.add_argument('--chunk_rows', type=int, default=DEFAULT_CHUNK_ROWS, help='Rows parsed per chunk')
+
+    args = parser.parse_args()
+
+    build_cache(args.report_path, args.cache_dir, args.chunk_rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Declared column types of the genotype tables passed between pipeline steps
+# (final reports, SNP maps, filtered SNP tables) and the readers that apply them.
+#
+# Sample and SNP names are categoricals, chromosomes int8 codes, positions int32,
+# intensities float32 and allele calls categoricals of their few one-letter values.
+# Equality and isin() tests on these columns then compare integer codes, not strings.
+#
+# Chromosome codes follow the PLINK sheep convention: numeric labels keep their
+# number and X, Y, XY, MT are 27, 28, 29, 30. Unknown labels are coded -1 (missing).
+# label_chromosomes() turns the codes back into labels before a table is written.
+
+import numpy as np
+import pandas as pd
+from final_report_cache import is_cache, read_cache, read_text_header
+
+CHR_DTYPE = 'int8'
+
+SCHEMA = {
+    'Sample ID': 'category',
+    'SNP Name': 'category',
+    'Chr': CHR_DTYPE,
+    'Chromosome': CHR_DTYPE,
+    'Position': 'int32',
+    'Log R Ratio': 'float32',
+    'B Allele Freq': 'float32',
+    'GC Score': 'float32',
+    'GT Score': 'float32',
+    'X': 'float32',
+    'Y': 'float32',
+    'R': 'float32',
+    'Theta': 'float32',
+    'Allele1 - Top': 'category',
+    'Allele2 - Top': 'category',
+    'Allele1 - AB': 'category',
+    'Allele2 - AB': 'category',
+    'Allele1 - Forward': 'category',
+    'Allele2 - Forward': 'category',
+}
+
+SPECIAL_CHR_CODES = {'X': 27, 'Y': 28, 'XY': 29, 'MT': 30}
+
+# Label of every code, for writing codes back out
+CHR_LABELS = [str(code) for code in range(np.iinfo(CHR_DTYPE).max + 1)]
+for label, code in SPECIAL_CHR_CODES.items():
+    CHR_LABELS[code] = label
+
+def chr_code(label):
+    # Code of a single chromosome label ('1', 1, 'X', 'chr1', ...), -1 if unknown
+    if pd.isna(label):
+        return -1
+    label = str(label).strip().upper()
+    if label.startswith('CHR'):
+        label = label[3:]
+    if label in SPECIAL_CHR_CODES:
+        return SPECIAL_CHR_CODES[label]
+    if label.isdigit() and int(label) <= np.iinfo(CHR_DTYPE).max:
+        return int(label)
+    return -1
+
+def encode_chr(values):
+    # int8 codes of a column of chromosome labels, converting each distinct label once
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values):
+        numbers = values.to_numpy(dtype=float)
+        known = (numbers >= 0) & (numbers <= np.iinfo(CHR_DTYPE).max) & (numbers == np.floor(numbers))
+        return np.where(known, np.nan_to_num(numbers), -1).astype(CHR_DTYPE)
+    labels = values.astype('category').cat
+    lookup = np.array([chr_code(label) for label in labels.categories] + [-1], dtype=CHR_DTYPE)
+    return lookup[labels.codes.to_numpy()]
+
+def chr_labels(codes):
+    # Categorical of chromosome labels for an array of codes (NaN for -1)
+    return pd.Categorical.from_codes(np.asarray(codes), categories=CHR_LABELS)
+
+def pandas_dtypes():
+    # dtype argument for pd.read_csv; chromosomes are read as categoricals and coded afterwards,
+    # positions are cast once it is known that none is missing
+    return {column: ('category' if dtype == CHR_DTYPE else dtype) for column, dtype in SCHEMA.items()
+            if column != 'Position'}
+
+def apply_schema(df):
+    # Convert the schema columns of a DataFrame in place and return it
+    for column in df.columns.intersection(list(SCHEMA)):
+        dtype = SCHEMA[column]
+        if dtype == CHR_DTYPE:
+            if df[column].dtype != CHR_DTYPE:
+                df[column] = encode_chr(df[column])
+        elif dtype == 'category':
+            if not isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype('category')
+        elif dtype == 'int32':
+            if not df[column].isna().any():
+                df[column] = df[column].astype(dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+def read_table(path, columns=None, **kwargs):
+    # Read a tab-delimited table with the schema applied to the columns it knows
+    return apply_schema(pd.read_csv(path, sep='\t', usecols=columns, dtype=pandas_dtypes(), **kwargs))
+
+def read_report(path, columns=None):
+    # Read the [Data] section of a text final report or a columnar cache with the schema applied
+    if is_cache(path):
+        return apply_schema(read_cache(path, columns))
+    return read_table(path, columns, skiprows=len(read_text_header(path)))
+
+def index_codes(series, labels):
+    # Position of every value of a categorical series in `labels` (-1 where absent),
+    # looked up once per category rather than once per row
+    lookup = np.append(pd.Index(labels).get_indexer(series.cat.categories), -1)
+    return lookup[series.cat.codes.to_numpy()]
+
+def relabel(series, func):
+    # Apply func to the categories of a categorical series; categories that end up
+    # equal are merged and categories mapped to NaN become missing values
+    labels = func(pd.Series(series.cat.categories))
+    categories = pd.unique(labels.dropna())
+    lookup = np.append(pd.Index(categories).get_indexer(labels), -1)
+    return pd.Series(pd.Categorical.from_codes(lookup[series.cat.codes.to_numpy()], categories=categories),
+                     index=series.index, name=series.name)
+
+def label_chromosomes(df):
+    # Turn chromosome codes back into labels in place (before writing a table) and return df
+    for column in df.columns.intersection([column for column, dtype in SCHEMA.items() if dtype == CHR_DTYPE]):
+        if df[column].dtype == CHR_DTYPE:
+            df[column] = chr_labels(df[column])
+    return df
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# Per-chromosome index of genomic intervals (CNVRs, CNVs, segments) for batch
+# containment, overlap and point-in-interval joins.
+#
+# The index keeps, for every chromosome, the intervals sorted by start together
+# with the longest interval length. An interval can only cover a position p if
+# its start lies in [p - longest, p], so every query is answered by two binary
+# searches over the sorted starts followed by a check of that (short) candidate
+# range, instead of a scan of all intervals.
+#
+# Coordinates are inclusive at both ends, as posStart/posEnd are in the CNV and
+# CNVR tables. Every query returns index pairs (query_rows, interval_rows) of
+# positional row numbers, ordered by query row and then interval row.
+
+import numpy as np
+import pandas as pd
+
+def build_index(chrom, start, end):
+    # Index intervals given as equally long arrays; chromosome labels are matched by equality
+    chrom = np.asarray(chrom)
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+
+    codes, labels = pd.factorize(chrom)
+    order = np.lexsort((start, codes))
+    bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+
+    index = {}
+    for code, label in enumerate(labels):
+        rows = order[bounds[code]:bounds[code + 1]]
+        index[label] = {'rows': rows,
+                        'starts': start[rows],
+                        'ends': end[rows],
+                        'longest': int((end[rows] - start[rows]).max())}
+    return index
+
+def _candidate_pairs(index, chrom, low, high):
+    # Pairs of every query with the intervals of its chromosome that start in [low - longest, high],
+    # i.e. every interval that may cover some position between low and high
+    chrom = np.asarray(chrom)
+    codes, labels = pd.factorize(chrom)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+
+    query_rows, interval_slots, entries = [], [], []
+    for code, label in enumerate(labels):
+        entry = index.get(label)
+        if entry is None:
+            continue
+        rows = order[bounds[code]:bounds[code + 1]]
+        first = np.searchsorted(entry['starts'], low[rows] - entry['longest'], side='left')
+        last = np.searchsorted(entry['starts'], high[rows], side='right')
+        counts = np.maximum(last - first, 0)
+
+        # Expand each [first, last) slot range into one pair per slot
+        offsets = np.repeat(first - np.cumsum(counts) + counts, counts)
+        query_rows.append(np.repeat(rows, counts))
+        interval_slots.append(offsets + np.arange(counts.sum()))
+        entries.append(entry)
+
+    return query_rows, interval_slots, entries
+
+def _join(index, chrom, low, high, keep):
+    # keep(slot_starts, slot_ends, query_rows) decides which candidate pairs are returned
+    low = np.asarray(low, dtype=np.int64)
+    high = np.asarray(high, dtype=np.int64)
+    pairs_q, pairs_i = [], []
+    for rows, slots, entry in zip(*_candidate_pairs(index, chrom, low, high)):
+        mask = keep(entry['starts'][slots], entry['ends'][slots], rows)
+        pairs_q.append(rows[mask])
+        pairs_i.append(entry['rows'][slots[mask]])
+
+    query_rows = np.concatenate(pairs_q) if pairs_q else np.empty(0, dtype=np.int64)
+    interval_rows = np.concatenate(pairs_i) if pairs_i else np.empty(0, dtype=np.int64)
+    order = np.lexsort((interval_rows, query_rows))
+    return query_rows[order], interval_rows[order]
+
+def contain_pairs(index, chrom, start, end):
+    # Intervals that contain each query interval: interval start <= query start and query end <= interval end
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    return _join(index, chrom, start, start,
+                 lambda starts, ends, rows: (starts <= start[rows]) & (ends >= end[rows]))
+
+def overlap_pairs(index, chrom, start, end):
+    # Intervals that share at least one base with each query interval
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    return _join(index, chrom, start, end,
+                 lambda starts, ends, rows: ends >= start[rows])
+
+def point_pairs(index, chrom, position):
+    # Intervals that contain each query position
+    position = np.asarray(position, dtype=np.int64)
+    return contain_pairs(index, chrom, position, position)
+
+def first_match(pairs, n_queries):
+    # Row of the first interval (in interval row order) matched by each query, -1 if none
+    query_rows, interval_rows = pairs
+    match = np.full(n_queries, -1, dtype=np.int64)
+    queries, first = np.unique(query_rows, return_index=True)
+    match[queries] = interval_rows[first]
+    return match
+
+def group_by_interval(pairs, n_intervals):
+    # Query rows matched by each interval, as a list of arrays in query row order
+    query_rows, interval_rows = pairs
+    order = np.lexsort((query_rows, interval_rows))
+    bounds = np.searchsorted(interval_rows[order], np.arange(n_intervals + 1))
+    return np.split(query_rows[order], bounds[1:-1])
+
+def nearest_interval(index, chrom, position):
+    # Row of the interval nearest to each query position and its distance in bp (0 inside an interval,
+    # otherwise to the closest end); -1 for both where the chromosome has no interval. Ties go to the left.
+    chrom = np.asarray(chrom)
+    position = np.asarray(position, dtype=np.int64)
+    nearest = np.full(len(position), -1, dtype=np.int64)
+    distance = np.full(len(position), -1, dtype=np.int64)
+    no_interval = np.iinfo(np.int64).max
+
+    codes, labels = pd.factorize(chrom)
+    for code, label in enumerate(labels):
+        entry = index.get(label)
+        if entry is None:
+            continue
+        rows = np.flatnonzero(codes == code)
+        n = len(entry['starts'])
+
+        # First interval starting after the position, and last interval (by end) ending before it
+        right = np.searchsorted(entry['starts'], position[rows], side='right')
+        end_order = np.argsort(entry['ends'], kind='stable')
+        sorted_ends = entry['ends'][end_order]
+        left = np.searchsorted(sorted_ends, position[rows], side='left') - 1
+
+        right_distance = np.where(right < n, entry['starts'][np.minimum(right, n - 1)] - position[rows], no_interval)
+        left_distance = np.where(left >= 0, position[rows] - sorted_ends[np.maximum(left, 0)], no_interval)
+        use_left = left_distance <= right_distance
+        nearest[rows] = np.where(use_left, entry['rows'][end_order[np.maximum(left, 0)]],
+                                 entry['rows'][np.minimum(right, n - 1)])
+        distance[rows] = np.minimum(left_distance, right_distance)
+
+    # Positions inside an interval are matched to the first interval containing them
+    inside = first_match(point_pairs(index, chrom, position), len(position))
+    nearest[inside >= 0] = inside[inside >= 0]
+    distance[inside >= 0] = 0
+    return nearest, distance
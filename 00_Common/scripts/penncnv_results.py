@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# Parsers for PennCNV per-sample results: .rawcnv call files and .log files.
+#
+# A rawcnv line looks like
+#     chr1:1234-5678   numsnp=10   length=4,445   state2,cn=1 /path/HR123.txt startsnp=s1 endsnp=s2 [conf=...]
+# and the quality summary that PennCNV writes to the log like
+#     NOTICE: quality summary for /path/HR123.txt: LRR_mean=0.0031 LRR_median=0.0000 LRR_SD=0.1506 ...
+# Both are matched with the compiled expressions below over whole files at once.
+
+import os
+import re
+import pandas as pd
+
+RAWCNV_LINE = re.compile(r'^(?P<chr>[^:\s]+):(?P<start>\d+)-(?P<end>\d+)\s+numsnp=(?P<numsnp>\d+)\s+length=\S+\s+'
+                         r'state\d+,cn=(?P<cn>\d+)\s+(?P<file>\S+)\s+startsnp=(?P<startsnp>\S+)\s+endsnp=(?P<endsnp>\S+)',
+                         re.MULTILINE)
+QC_LINE = re.compile(r'quality summary for (?P<file>\S+?):\s+(?P<stats>\S+=.*)$', re.MULTILINE)
+QC_STAT = re.compile(r'(\w+)=(\S+)')
+
+# Columns of the formatted CNV table read by the CNV-GWAS steps
+CNV_COLUMNS = ['chr', 'start', 'end', 'sample id', 'state', 'num snps', 'start probe', 'end probe']
+
+def sample_id(file_path, sample_pattern=None):
+    # Sample ID of a PennCNV signal file: the first match of sample_pattern in the path if given
+    # (and found), otherwise the file name
+    if sample_pattern is not None:
+        match = sample_pattern.search(file_path)
+        if match:
+            return match.group(0)
+    return os.path.basename(file_path)
+
+def parse_rawcnv(text, sample_pattern=None):
+    # Formatted CNV table (CNV_COLUMNS) of every call line in rawcnv text; 'state' is the copy number
+    calls = [match.groupdict() for match in RAWCNV_LINE.finditer(text)]
+    cnv_df = pd.DataFrame(calls, columns=['chr', 'start', 'end', 'numsnp', 'cn', 'file', 'startsnp', 'endsnp'])
+    return pd.DataFrame({
+        'chr': cnv_df['chr'],
+        'start': cnv_df['start'].astype('int64'),
+        'end': cnv_df['end'].astype('int64'),
+        'sample id': [sample_id(path, sample_pattern) for path in cnv_df['file']],
+        'state': cnv_df['cn'].astype('int64'),
+        'num snps': cnv_df['numsnp'].astype('int64'),
+        'start probe': cnv_df['startsnp'],
+        'end probe': cnv_df['endsnp'],
+    }, columns=CNV_COLUMNS)
+
+def count_call_lines(text):
+    # Non-empty lines of rawcnv text, to report lines the parser did not recognise
+    return sum(1 for line in text.splitlines() if line.strip())
+
+def parse_qc(text, sample_pattern=None):
+    # One row per quality summary in log text: Sample_ID, File and every statistic (LRR_SD, BAF_DRIFT, WF, ...)
+    rows = []
+    for match in QC_LINE.finditer(text):
+        row = {'Sample_ID': sample_id(match.group('file'), sample_pattern), 'File': match.group('file')}
+        row.update((key, pd.to_numeric(value, errors='coerce')) for key, value in QC_STAT.findall(match.group('stats')))
+        rows.append(row)
+    return pd.DataFrame(rows, columns=None if rows else ['Sample_ID', 'File'])
+
+def add_cnv_counts(qc_df, cnv_df):
+    # Number of calls of every sample in the QC table (NumCNV, as in filter_cnv.pl -qcsumout)
+    counts = cnv_df['sample id'].value_counts()
+    qc_df['NumCNV'] = qc_df['Sample_ID'].map(counts).fillna(0).astype('int64')
+    return qc_df
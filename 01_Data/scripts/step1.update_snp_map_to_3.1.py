@@ -1,43 +1,143 @@
 #!/usr/bin/env python3
 
+import os
+import numpy as np
 import pandas as pd
 import argparse
 
-def update_positions(file1_path, file2_path, output_path):
-    # Read file1 and file2
-    file1 = pd.read_csv(file1_path, sep='\t')  # Assume file1 is tab-separated
-    file2 = pd.read_csv(file2_path, sep='\t')  # Assume file2 is tab-separated
-    
-    # Merge based on SNP_name from file1 and Name from file2
-    merged_df = pd.merge(file1, file2, left_on='SNP_name', right_on='Name')
-    
-    # Update Position and Chromosome in file2 with values from file1
-    merged_df['Position'] = merged_df['position']
-    merged_df['Chromosome'] = merged_df['chromosome']
-    
-    # Select necessary columns, keeping only rows present in file1
-    result_df = merged_df[file2.columns]
-    
+# Number of final report rows remapped per chunk
+REPORT_CHUNK_ROWS = 2_000_000
+
+def build_remap_index(snpchimp_path):
+    # Remapping index keyed by SNP name: names sorted once so that lookups are binary searches
+    snpchimp = pd.read_csv(snpchimp_path, sep='\t', usecols=['SNP_name', 'chromosome', 'position'], dtype={'chromosome': str})
+    if snpchimp['SNP_name'].duplicated().any():
+        raise ValueError(f"Duplicated SNP names found in {snpchimp_path}; the remapping needs one record per SNP")
+
+    names = snpchimp['SNP_name'].to_numpy(dtype=str)
+    order = np.argsort(names)
+    return {'names': names[order],
+            'chromosomes': snpchimp['chromosome'].to_numpy(dtype=str)[order],
+            'positions': snpchimp['position'].to_numpy(dtype=np.int64)[order]}
+
+def save_remap_index(index, index_path):
+    with open(index_path, 'wb') as file:
+        np.savez(file, **index)
+
+def load_remap_index(path):
+    # A saved .npz index is loaded as is; anything else is read as a SNPchimp table
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            return {key: data[key] for key in ('names', 'chromosomes', 'positions')}
+    return build_remap_index(path)
+
+def lookup(index, snp_names):
+    # Binary search of every name in the index; returns (found, chromosome, position)
+    snp_names = np.asarray(snp_names, dtype=str)
+    if len(index['names']) == 0:
+        # An empty index maps no SNP
+        return (np.zeros(len(snp_names), dtype=bool), np.full(len(snp_names), '', dtype=index['chromosomes'].dtype),
+                np.zeros(len(snp_names), dtype=index['positions'].dtype))
+    slots = np.searchsorted(index['names'], snp_names)
+    slots[slots == len(index['names'])] = 0
+    found = index['names'][slots] == snp_names
+    return found, index['chromosomes'][slots], index['positions'][slots]
+
+def update_positions(index, file2_path, output_path):
+    # Read the SNP map
+    file2 = pd.read_csv(file2_path, sep='\t')
+
+    # Look up each Name in the index; SNPs missing from the index are dropped
+    found, chromosomes, positions = lookup(index, file2['Name'])
+    old_chromosomes = file2['Chromosome'].astype(str).to_numpy()
+
+    # Update Position and Chromosome with the values from the index
+    result_df = file2[found].copy()
+    result_df['Position'] = positions[found]
+    result_df['Chromosome'] = chromosomes[found]
+
     # Sort the result by Index
     result_df = result_df.sort_values(by='Index')
-    
+
+    # Per chromosome counts: unmapped probes under their old chromosome, the rest under the new one
+    counts = pd.DataFrame({'Chromosome': np.where(found, chromosomes, old_chromosomes),
+                           'mapped': found & (positions != 0),
+                           'position_0': found & (positions == 0),
+                           'unmapped': ~found})
+    counts = counts.groupby('Chromosome', sort=False).sum()
+    counts = counts.loc[sorted(counts.index, key=lambda chr_: (not chr_.isdigit(), int(chr_) if chr_.isdigit() else 0, chr_))]
+
     # Filter out rows where Position is 0
     result_df = result_df[result_df['Position'] != 0]
-    
+
     # Write the result to the output file
     result_df.to_csv(output_path, sep='\t', index=False)
 
+    print(f"{file2_path}: {len(result_df)} SNPs remapped, {counts['position_0'].sum()} with position 0 and "
+          f"{counts['unmapped'].sum()} unmapped dropped")
+    return counts.reset_index()
+
+def update_report(index, report_path, output_path, chunk_rows=REPORT_CHUNK_ROWS):
+    # Keep the final report rows whose SNP is mapped to a non-zero position, updating Chr/Position if the report has them
+    header_lines = []
+    with open(report_path, 'r') as file:
+        for line in file:
+            header_lines.append(line)
+            if line.startswith('[Data]'):
+                break
+        else:
+            raise ValueError(f"No [Data] section found in {report_path}")
+
+    n_kept = n_dropped = 0
+    with open(output_path, 'w') as outfile:
+        outfile.writelines(header_lines)
+        reader = pd.read_csv(report_path, sep='\t', skiprows=len(header_lines), dtype=str, keep_default_na=False,
+                             chunksize=chunk_rows)
+        for i, chunk in enumerate(reader):
+            found, chromosomes, positions = lookup(index, chunk['SNP Name'])
+            keep = found & (positions != 0)
+            chunk = chunk[keep].copy()
+            for column, values in (('Chr', chromosomes), ('Chromosome', chromosomes), ('Position', positions)):
+                if column in chunk.columns:
+                    chunk[column] = values[keep]
+            chunk.to_csv(outfile, sep='\t', index=False, header=i == 0)
+            n_kept += int(keep.sum())
+            n_dropped += int((~keep).sum())
+
+    print(f"{report_path}: {n_kept} rows kept, {n_dropped} rows of unmapped or position 0 SNPs dropped")
+
 def main():
     # Define command-line argument parser
     parser = argparse.ArgumentParser(description='Update positions and chromosomes in file2 based on file1')
-    parser.add_argument('file1', type=str, help='Path to the first input file')
-    parser.add_argument('file2', type=str, help='Path to the second input file')
-    parser.add_argument('output', type=str, help='Path to the output file')
-    
+    parser.add_argument('file1', type=str, help='Path to the SNPchimp file, or a remapping index saved with --save_index (.npz)')
+    parser.add_argument('file2', type=str, nargs='?', help='Path to the SNP map to update')
+    parser.add_argument('output', type=str, nargs='?', help='Path to the output file')
+    parser.add_argument('--save_index', type=str, help='Save the remapping index to this .npz file for later runs')
+    parser.add_argument('--map', nargs=2, action='append', default=[], metavar=('MAP', 'OUTPUT'),
+                        help='Further SNP map to update and its output path (repeatable)')
+    parser.add_argument('--report', nargs=2, action='append', default=[], metavar=('REPORT', 'OUTPUT'),
+                        help='Final report to filter (and update Chr/Position in) and its output path (repeatable)')
+    parser.add_argument('--counts_file', type=str, help='Path to save per chromosome counts of mapped, position 0 and unmapped probes')
+
     args = parser.parse_args()
-    
-    # Update positions and chromosomes in file2 based on file1
-    update_positions(args.file1, args.file2, args.output)
+    if (args.file2 is None) != (args.output is None):
+        parser.error("file2 and output must be given together")
+
+    # Build the remapping index once (or load a saved one) and apply it to every map and report
+    index = load_remap_index(args.file1)
+    if args.save_index:
+        save_remap_index(index, args.save_index)
+        print(f"Remapping index of {len(index['names'])} SNPs saved to {args.save_index}")
+
+    maps = ([(args.file2, args.output)] if args.file2 else []) + args.map
+    counts = [update_positions(index, map_path, output_path).assign(file=os.path.basename(map_path))
+              for map_path, output_path in maps]
+    for report_path, output_path in args.report:
+        update_report(index, report_path, output_path)
+
+    if args.counts_file and counts:
+        counts = pd.concat(counts)
+        counts[['file', 'Chromosome', 'mapped', 'position_0', 'unmapped']].to_csv(args.counts_file, sep='\t', index=False)
 
 if __name__ == '__main__':
     main()
@@ -1,48 +1,68 @@
 #!/usr/bin/env python3
 
 import pandas as pd
-import sys
-import io
-
-def update_final_report(new_snp_map_file, final_report_file, output_file):
-    # Read the new_snp_map file
-    new_snp_map = pd.read_csv(new_snp_map_file, sep='\t')
-    
-    # Read the final_report file
-    with open(final_report_file, 'r') as file:
-        lines = file.readlines()
-    
-    # Find the starting index of the [Data] section
-    data_start_index = lines.index('[Data]\n') + 1
-    header_lines = lines[:data_start_index]
-    data_lines = lines[data_start_index:]
-    
-    # Parse the [Data] section into a DataFrame
-    final_report_data = pd.read_csv(io.StringIO(''.join(data_lines)), sep='\t')
-    
+import argparse
+from final_report_cache import is_cache, read_meta, open_column, label_lookup, write_text_report
+
+# Number of bytes of [Data] rows read, filtered and written per chunk
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+def update_final_report(new_snp_map_file, final_report_file, output_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Read only the SNP names from the new_snp_map file and hash them for fast lookup
+    new_snp_map = pd.read_csv(new_snp_map_file, sep='\t', usecols=['Name'])
+    snp_set = set(new_snp_map['Name'].astype(str))
+
     # Update Num SNPs value
-    num_snps = new_snp_map['Name'].nunique()
-    
-    # Update the header with the new Num SNPs value
-    for i, line in enumerate(header_lines):
-        if line.startswith('Num SNPs'):
-            header_lines[i] = f'Num SNPs\t{num_snps}\n'
-    
-    # Merge the two DataFrames
-    updated_final_report_data = final_report_data[final_report_data['SNP Name'].isin(new_snp_map['Name'])]
-    
-    # Write the output file
-    with open(output_file, 'w') as file:
-        file.writelines(header_lines)
-        updated_final_report_data.to_csv(file, sep='\t', index=False)
+    num_snps = len(snp_set)
+
+    if is_cache(final_report_file):
+        update_final_report_from_cache(snp_set, num_snps, final_report_file, output_file)
+        return
+
+    with open(final_report_file, 'r', buffering=chunk_size) as infile, \
+         open(output_file, 'w', buffering=chunk_size) as outfile:
+        # Find the [Data] section once, updating the header with the new Num SNPs value
+        for line in infile:
+            if line.startswith('Num SNPs'):
+                line = f'Num SNPs\t{num_snps}\n'
+            outfile.write(line)
+            if line == '[Data]\n':
+                break
+        else:
+            raise ValueError(f"No [Data] section found in {final_report_file}")
+
+        # Locate the SNP Name column from the column header line
+        column_line = infile.readline()
+        outfile.write(column_line)
+        snp_col = column_line.rstrip('\n').split('\t').index('SNP Name')
+
+        # Filter the [Data] rows chunk by chunk and write each chunk as soon as it is done
+        while True:
+            lines = infile.readlines(chunk_size)
+            if not lines:
+                break
+            outfile.writelines([line for line in lines if line.split('\t', snp_col + 1)[snp_col] in snp_set])
+
+def update_final_report_from_cache(snp_set, num_snps, cache_dir, output_file):
+    meta = read_meta(cache_dir)
+    header_lines = [f'Num SNPs\t{num_snps}\n' if line.startswith('Num SNPs') else line for line in meta['header']]
+
+    # Decide once per SNP label whether it is kept, then index that decision with the memory-mapped codes
+    snp_codes, snp_labels = open_column(cache_dir, 'SNP Name', meta)
+    keep_snp = label_lookup(snp_labels, snp_set)
+
+    write_text_report(cache_dir, output_file, header_lines, lambda rows: keep_snp[snp_codes[rows]])
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep only the final report rows whose SNP is present in the new SNP map.')
+    parser.add_argument('new_snp_map_file', type=str, help='Path to the updated SNP map')
+    parser.add_argument('final_report_file', type=str, help='Path to the final report (text or columnar cache directory)')
+    parser.add_argument('output_file', type=str, help='Path to the output final report')
+    parser.add_argument('--chunk_size', type=int, default=DEFAULT_CHUNK_SIZE, help='Bytes of [Data] rows processed per chunk')
+
+    args = parser.parse_args()
+
+    update_final_report(args.new_snp_map_file, args.final_report_file, args.output_file, args.chunk_size)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: python update_final_report.py <new_snp_map_file> <final_report_file> <output_file>")
-        sys.exit(1)
-    
-    new_snp_map_file = sys.argv[1]
-    final_report_file = sys.argv[2]
-    output_file = sys.argv[3]
-    
-    update_final_report(new_snp_map_file, final_report_file, output_file)
+    main()
@@ -1,61 +1,182 @@
 #!/usr/bin/env python3
 
 import pandas as pd
+import numpy as np
 import argparse
+from genotype_schema import read_report, read_table, index_codes
 
-def main(genotype_file, snp_map_file, ped_file, map_file):
-    # Load SNP mapping data
-    snp_map_df = pd.read_csv(snp_map_file, sep='\t')
-    
-    # Filter SNPs to include only those on chromosomes 1-26
-    valid_chromosomes = [str(i) for i in range(1, 27)]
-    snp_map_df = snp_map_df[snp_map_df['Chromosome'].isin(valid_chromosomes)]
-    
-    snp_map = snp_map_df[['Name', 'Chromosome', 'Position']]
+# Number of samples whose PED lines are written in one block
+PED_BLOCK_SIZE = 256
 
-    # Load genotype data
-    genotype_df = pd.read_csv(genotype_file, sep='\t', skiprows=9)
-    genotype_data = genotype_df[['Sample ID', 'SNP Name', 'Allele1 - Top', 'Allele2 - Top']]
+# Allele codes treated as a missing call, as PLINK does when it reads a .ped file
+MISSING_ALLELES = {'0', '-', 'nan'}
 
-    # Remove spaces from Sample ID and underscores
-    genotype_data['Sample ID'] = genotype_data['Sample ID'].str.replace(' ', '').str.replace('_', '')
+# 2-bit .bed genotype codes, relative to the .bim A1 allele
+BED_HOM_A1, BED_MISSING, BED_HET, BED_HOM_A2 = 0b00, 0b01, 0b10, 0b11
 
-    # Merge genotype data with SNP map to avoid repetitive lookups
-    merged_data = genotype_data.merge(snp_map, left_on='SNP Name', right_on='Name', how='left')
+# Number of SNPs counted and packed at a time when writing the .bed file
+BED_BLOCK_SIZE = 4096
 
-    # Generate .map file
-    snp_map.to_csv(map_file, sep=' ', header=False, index=False, columns=['Chromosome', 'Name', 'Position'])
+def factorize_alleles(alleles):
+    # Code an allele column over its distinct calls; a missing call is labelled 'nan', as str() gives it
+    codes, labels = pd.factorize(alleles)
+    labels = [str(label) for label in labels]
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(labels), codes)
+        labels.append('nan')
+    return codes, labels
 
-    # Generate .ped file
+def build_genotype_matrix(genotype_data, snp_names):
+    # Pivot the long genotype table into a samples x SNPs matrix of genotype codes, columns in .map order.
+    # Code 0 is a missing genotype; code k > 0 is the (allele1, allele2) pair genotype_alleles[k].
+    sample_codes, sample_labels = pd.factorize(genotype_data['Sample ID'])
+
+    # Remove spaces from Sample ID and underscores, on the distinct IDs only
+    cleaned_labels = pd.Series(sample_labels).astype(str).str.replace(' ', '').str.replace('_', '')
+    sample_ids = cleaned_labels.unique()
+    sample_rows = pd.Index(sample_ids).get_indexer(cleaned_labels)[sample_codes]
+
+    # Map column of every SNP, looked up once per distinct SNP Name
+    snp_cols = index_codes(genotype_data['SNP Name'], snp_names)
+
+    # Code each allele over its small vocabulary, then combine both codes into one pair code
+    allele1_codes, allele1_labels = factorize_alleles(genotype_data['Allele1 - Top'])
+    allele2_codes, allele2_labels = factorize_alleles(genotype_data['Allele2 - Top'])
+    pair_codes = allele1_codes * len(allele2_labels) + allele2_codes + 1
+    genotype_alleles = [('0', '0')] + [(a1, a2) for a1 in allele1_labels for a2 in allele2_labels]
+
+    # Keep rows of known samples and SNPs present in the map; a duplicated sample/SNP pair keeps its last record
+    known = (sample_codes >= 0) & (snp_cols >= 0)
+    cells = pd.DataFrame({'row': sample_rows[known], 'col': snp_cols[known], 'code': pair_codes[known]})
+    cells = cells.drop_duplicates(subset=['row', 'col'], keep='last')
+
+    matrix = np.zeros((len(sample_ids), len(snp_names)), dtype=np.min_scalar_type(len(genotype_alleles)))
+    matrix[cells['row'].to_numpy(), cells['col'].to_numpy()] = cells['code'].to_numpy()
+
+    return sample_ids, matrix, genotype_alleles
+
+def write_ped(ped_file, sample_ids, matrix, genotype_alleles):
+    tokens = np.array([f"{a1} {a2} " for a1, a2 in genotype_alleles], dtype=object)
     with open(ped_file, 'w') as ped_f:
-        sample_ids = genotype_data['Sample ID'].unique()
-        for sample_id in sample_ids:
-            # Write initial columns: family ID, individual ID, father ID, mother ID, sex (0 for unknown), phenotype (-9 for unknown)
-            ped_f.write(f"{sample_id} {sample_id} 0 0 0 -9 ")
+        for start in range(0, len(sample_ids), PED_BLOCK_SIZE):
+            # Initial columns: family ID, individual ID, father ID, mother ID, sex (0 for unknown), phenotype (-9 for unknown)
+            ped_f.writelines([f"{sample_id} {sample_id} 0 0 0 -9 " + ''.join(tokens[row]) + '\n'
+                              for sample_id, row in zip(sample_ids[start:start + PED_BLOCK_SIZE],
+                                                        matrix[start:start + PED_BLOCK_SIZE])])
+
+def write_bfile(bfile_prefix, sample_ids, matrix, genotype_alleles, snp_map):
+    # Write SNP-major .bed/.bim/.fam files equal to what `plink --file ... --make-bed` produces from the .ped/.map
+    n_samples = len(sample_ids)
+
+    # Index every allele seen in the genotype codes; missing and half-missing calls have no index
+    allele_labels = sorted({a for pair in genotype_alleles for a in pair} - MISSING_ALLELES)
+    allele_labels += ['0'] * max(0, 2 - len(allele_labels))
+    allele_index = {a: i for i, a in enumerate(allele_labels)}
+    labels = np.array(allele_labels, dtype=object)
+    pair_index = [None if a1 in MISSING_ALLELES or a2 in MISSING_ALLELES else (allele_index[a1], allele_index[a2])
+                  for a1, a2 in genotype_alleles]
+
+    # PLINK sorts the variants of an unsorted .map by chromosome and position
+    chromosomes = pd.to_numeric(snp_map['Chromosome']).to_numpy()
+    positions = snp_map['Position'].to_numpy()
+    snp_order = np.lexsort((positions, chromosomes))
+
+    with open(f"{bfile_prefix}.fam", 'w') as fam_f:
+        fam_f.writelines([f"{sample_id} {sample_id} 0 0 0 -9\n" for sample_id in sample_ids])
 
-            # Filter sample genotypes once
-            sample_genotypes = merged_data[merged_data['Sample ID'] == sample_id]
+    with open(f"{bfile_prefix}.bed", 'wb') as bed_f, open(f"{bfile_prefix}.bim", 'w') as bim_f:
+        # Magic number followed by the SNP-major mode byte
+        bed_f.write(bytes([0x6c, 0x1b, 0x01]))
 
-            # Use a dict for fast lookup
-            snp_dict = sample_genotypes.set_index('SNP Name')[['Allele1 - Top', 'Allele2 - Top']].to_dict('index')
+        for start in range(0, len(snp_order), BED_BLOCK_SIZE):
+            block_snps = snp_order[start:start + BED_BLOCK_SIZE]
+            block = matrix[:, block_snps]
+            codes = [code for code in np.unique(block) if pair_index[code] is not None]
 
-            for snp_name in snp_map['Name']:
-                if snp_name in snp_dict:
-                    alleles = snp_dict[snp_name]
-                    ped_f.write(f"{alleles['Allele1 - Top']} {alleles['Allele2 - Top']} ")
-                else:
-                    ped_f.write("0 0 ")
+            # Count each allele and record where it first appears (allele1 before allele2 within a sample)
+            counts = np.zeros((len(block_snps), len(allele_labels)), dtype=np.int64)
+            first_seen = np.full((len(block_snps), len(allele_labels)), 2 * n_samples, dtype=np.int64)
+            for code in codes:
+                i1, i2 = pair_index[code]
+                hits = block == code
+                n_hits = hits.sum(axis=0)
+                first_row = np.where(n_hits > 0, hits.argmax(axis=0), n_samples)
+                counts[:, i1] += n_hits
+                counts[:, i2] += n_hits
+                first_seen[:, i1] = np.minimum(first_seen[:, i1], 2 * first_row)
+                first_seen[:, i2] = np.minimum(first_seen[:, i2], 2 * first_row + 1)
+
+            if ((counts > 0).sum(axis=1) > 2).any():
+                raise ValueError("More than two alleles found for a SNP; a .bed file can only hold biallelic SNPs")
+
+            # A2 is the most frequent allele and A1 the other one ('0' if monomorphic);
+            # equal counts keep the order of first appearance
+            ranked = np.argsort(first_seen - counts * (2 * n_samples + 2), axis=1, kind='stable')
+            snp_rows = np.arange(len(block_snps))
+            a2 = np.where(counts[snp_rows, ranked[:, 0]] > 0, labels[ranked[:, 0]], '0')
+            a1 = np.where(counts[snp_rows, ranked[:, 1]] > 0, labels[ranked[:, 1]], '0')
+
+            # Translate genotype codes into 2-bit calls relative to A1/A2
+            calls = np.full(block.shape, BED_MISSING, dtype=np.uint8)
+            for code in codes:
+                allele1, allele2 = genotype_alleles[code]
+                hom_a1 = (allele1 == a1) & (allele2 == a1)
+                hom_a2 = (allele1 == a2) & (allele2 == a2)
+                call = np.where(hom_a1, BED_HOM_A1, np.where(hom_a2, BED_HOM_A2, BED_HET)).astype(np.uint8)
+                calls = np.where(block == code, call[np.newaxis, :], calls)
+
+            # Pack four samples per byte, first sample in the lowest bits, padding the last byte with zeros
+            calls = calls.T
+            padding = (-n_samples) % 4
+            if padding:
+                calls = np.pad(calls, ((0, 0), (0, padding)))
+            calls = calls.reshape(len(block_snps), -1, 4)
+            packed = calls[:, :, 0] | (calls[:, :, 1] << 2) | (calls[:, :, 2] << 4) | (calls[:, :, 3] << 6)
+            bed_f.write(packed.astype(np.uint8).tobytes())
+
+            block_map = snp_map.iloc[block_snps]
+            bim_f.writelines([f"{chromosome}\t{name}\t0\t{position}\t{allele1}\t{allele2}\n"
+                              for chromosome, name, position, allele1, allele2
+                              in zip(block_map['Chromosome'], block_map['Name'], block_map['Position'], a1, a2)])
+
+def main(genotype_file, snp_map_file, ped_file=None, map_file=None, bfile_prefix=None):
+    # Load SNP mapping data
+    snp_map_df = read_table(snp_map_file)
+    
+    # Filter SNPs to include only those on chromosomes 1-26 (compared as chromosome codes)
+    snp_map_df = snp_map_df[snp_map_df['Chromosome'].isin(range(1, 27))]
+    
+    snp_map = snp_map_df[['Name', 'Chromosome', 'Position']]
+
+    # Load genotype data (text final report or columnar cache), only the needed columns
+    genotype_data = read_report(genotype_file, columns=['Sample ID', 'SNP Name', 'Allele1 - Top', 'Allele2 - Top'])
+
+    # Generate .map file
+    if map_file:
+        snp_map.to_csv(map_file, sep=' ', header=False, index=False, columns=['Chromosome', 'Name', 'Position'])
+
+    # Build the samples x SNPs genotype matrix once
+    sample_ids, matrix, genotype_alleles = build_genotype_matrix(genotype_data, snp_map['Name'])
+
+    # Generate .ped file
+    if ped_file:
+        write_ped(ped_file, sample_ids, matrix, genotype_alleles)
 
-            ped_f.write('\n')
+    # Generate binary .bed/.bim/.fam files
+    if bfile_prefix:
+        write_bfile(bfile_prefix, sample_ids, matrix, genotype_alleles, snp_map)
 
     print("PLINK files successfully generated.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate PLINK files from genotype and SNP map data.")
-    parser.add_argument('--genotype_file', type=str, required=True, help="Path to the genotype file.")
+    parser.add_argument('--genotype_file', type=str, required=True, help="Path to the genotype file (final report or its columnar cache directory).")
     parser.add_argument('--snp_map_file', type=str, required=True, help="Path to the SNP map file.")
-    parser.add_argument('--ped_file', type=str, required=True, help="Path to the output .ped file.")
-    parser.add_argument('--map_file', type=str, required=True, help="Path to the output .map file.")
+    parser.add_argument('--ped_file', type=str, help="Path to the output .ped file.")
+    parser.add_argument('--map_file', type=str, help="Path to the output .map file.")
+    parser.add_argument('--bfile', type=str, help="Output prefix for binary .bed/.bim/.fam files.")
 
     args = parser.parse_args()
-    main(args.genotype_file, args.snp_map_file, args.ped_file, args.map_file)
\ No newline at end of file
+    if not (args.ped_file or args.map_file or args.bfile):
+        parser.error("at least one of --ped_file, --map_file or --bfile is required")
+    main(args.genotype_file, args.snp_map_file, args.ped_file, args.map_file, args.bfile)
\ No newline at end of file
@@ -15,14 +15,22 @@ output_prefix="filtered_data"
 
 module load roslin/plink/1.90p
 
-# Check if input files exist
-if [[ ! -f "${input_prefix}.ped" || ! -f "${input_prefix}.map" ]]; then
-    echo "Error: input_data.ped or input_data.map not found."
+# Check if input files exist, preferring binary input written directly by step1.generate_ped_map.py
+if [[ -f "${input_prefix}.bed" && -f "${input_prefix}.bim" && -f "${input_prefix}.fam" ]]; then
+    input_flag="--bfile"
+    input_samples="${input_prefix}.fam"
+    input_snps="${input_prefix}.bim"
+elif [[ -f "${input_prefix}.ped" && -f "${input_prefix}.map" ]]; then
+    input_flag="--file"
+    input_samples="${input_prefix}.ped"
+    input_snps="${input_prefix}.map"
+else
+    echo "Error: input_data.bed/.bim/.fam or input_data.ped/.map not found."
     exit 1
 fi
 
 # Initial filtering: remove monomorphic SNPs and SNPs with MAF less than 0.01, also filter for genotype and sample missingness
-plink --file $input_prefix --maf 0.01 --geno 0.05 --mind 0.05 --make-bed --out ${output_prefix}_maf --allow-extra-chr
+plink $input_flag $input_prefix --maf 0.01 --geno 0.05 --mind 0.05 --make-bed --out ${output_prefix}_maf --allow-extra-chr
 if [[ $? -ne 0 ]]; then
     echo "Error: PLINK command failed at MAF filtering step."
     exit 1
@@ -43,8 +51,8 @@ if [[ $? -ne 0 ]]; then
 fi
 
 # Output the results
-initial_individuals=$(wc -l < ${input_prefix}.ped)
-initial_snps=$(wc -l < ${input_prefix}.map)
+initial_individuals=$(wc -l < ${input_samples})
+initial_snps=$(wc -l < ${input_snps})
 final_individuals=$(wc -l < ${output_prefix}_final.fam)
 final_snps=$(wc -l < ${output_prefix}_final.bim)
 
@@ -1,76 +1,219 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import heapq
+import shutil
 import argparse
+import tempfile
 import pandas as pd
 import numpy as np
+from final_report_cache import read_header, iter_final_report
+from genotype_schema import CHR_LABELS, pandas_dtypes, apply_schema, read_report, read_table, relabel, label_chromosomes, chr_labels
+
+# Define key columns
+KEY_COLUMNS = ["Sample ID", "Chromosome", "Position", "SNP Name", "Log R Ratio", "B Allele Freq"]
+
+# Report columns used; Chromosome and Position come from the map
+REPORT_COLUMNS = ["Sample ID", "SNP Name", "Log R Ratio", "B Allele Freq"]
+
+INTENSITY_COLUMNS = ["Log R Ratio", "B Allele Freq"]
+
+MISSING_LABELS = ['', 'NA', 'N/A', 'nan', 'NaN']
+
+# Rough peak memory per report row while a chunk is merged, sorted and formatted,
+# used to turn --memory_budget into a chunk size
+BYTES_PER_ROW = 1024
+
+# Maximum number of sorted runs merged at once; more runs are merged in several passes
+MAX_MERGE_RUNS = 128
+
+def missing_labels_to_nan(labels):
+    return labels.mask(labels.isin(MISSING_LABELS))
+
+def clean_values(df):
+    # Remove spaces in Sample ID and ensure missing values are represented as 'NaN',
+    # working on the distinct labels of the categorical ID columns
+    df["Sample ID"] = relabel(df["Sample ID"], lambda labels: missing_labels_to_nan(labels.str.replace(" ", "")))
+    df["SNP Name"] = relabel(df["SNP Name"], missing_labels_to_nan)
+
+def chr_sort_ranks(map_chr):
+    # Sort rank of every chromosome code (indexed by code + 1), as the map's Chromosome column sorts when read
+    # as is: by number when every label is numeric, by text (1, 10, 11, ..., 2, ..., X) once a label such as X
+    # is present. Unknown chromosomes sort last
+    codes = np.unique(np.asarray(map_chr))
+    codes = codes[codes >= 0]
+    labels = np.asarray(chr_labels(codes), dtype=str)
+    if not all(label.isdigit() for label in labels):
+        codes = codes[np.argsort(labels, kind='stable')]
+    ranks = np.full(len(CHR_LABELS) + 1, len(codes))
+    ranks[codes + 1] = np.arange(len(codes))
+    return ranks
+
+def intensities_as_text(df):
+    # float32 intensities back to the float64 of their shortest decimal form, so that they are written
+    # as read from the report (0.0001 rather than 1e-04)
+    for column in df.columns.intersection(INTENSITY_COLUMNS):
+        df[column] = df[column].to_numpy().astype(str).astype(np.float64)
+    return df
+
+def merge_map(report_df, map_df):
+    # Inner merge on the SNP name, compared as codes of the report's SNP Name categories
+    map_df = map_df.assign(Name=pd.Categorical(map_df["Name"], categories=report_df["SNP Name"].cat.categories))
+    map_df = map_df[map_df["Name"].notna()]
+    return pd.merge(left=report_df, right=map_df, left_on="SNP Name", right_on="Name", how="inner")
 
 def read_and_process_data(report_path, map_path, output_path, missing_data_output_path):
     try:
-        # Read the first 9 lines of headers
-        with open(report_path, 'r') as file:
-            header_lines = [next(file) for _ in range(9)]
-        
-        # Reading the report file starting from the 10th line
-        report_df = pd.read_csv(report_path, sep='\t', skiprows=9)
-        report_df = report_df[report_df.columns.drop(list(report_df.filter(regex='Allele1 - AB|Allele2 - AB')))]
+        # Read the header lines up to [Data]
+        header_lines = read_header(report_path)
+
+        # Reading the data section from the text report or its columnar cache, with compact column types
+        report_df = read_report(report_path, columns=REPORT_COLUMNS)
     except Exception as e:
         print(f"Error reading report file: {e}")
         return
 
     try:
         # Reading the map file
-        map_df = pd.read_csv(map_path, sep='\t', on_bad_lines='skip')
+        map_df = read_table(map_path, on_bad_lines='skip')
     except Exception as e:
         print(f"Error reading map file: {e}")
         return
 
     # Merging data
-    merged_df = pd.merge(left=report_df, right=map_df, left_on="SNP Name", right_on="Name", how="inner")
-
-    # Define key columns
-    key_columns = ["Sample ID", "Chromosome", "Position", "SNP Name", "Log R Ratio", "B Allele Freq"]
+    merged_df = merge_map(report_df, map_df)
 
     # Identify rows with missing values in key columns
-    missing_data_df = merged_df[key_columns].copy()
+    missing_data_df = merged_df[KEY_COLUMNS].copy()
     missing_data_df = missing_data_df[missing_data_df.isnull().any(axis=1)]
 
     # Sort the data
-    final_df = merged_df[key_columns]
-    final_df.rename(columns={"Chromosome": "Chr"}, inplace=True)
-    final_df.sort_values(by=["Sample ID", "Chr", "SNP Name"], inplace=True)
-
-    # Remove spaces in Sample ID
-    final_df["Sample ID"] = final_df["Sample ID"].str.replace(" ", "")
+    final_df = merged_df[KEY_COLUMNS].rename(columns={"Chromosome": "Chr"})
+    chr_ranks = chr_sort_ranks(map_df["Chromosome"])
+    final_df = final_df.assign(_chr=chr_ranks[final_df["Chr"].to_numpy().astype(int) + 1])
+    final_df = final_df.sort_values(by=["Sample ID", "_chr", "SNP Name"]).drop(columns="_chr")
 
-    # Ensure missing values are represented as 'NaN'
-    final_df.replace(['', 'NA', 'N/A', 'nan', 'NaN'], np.nan, inplace=True)
-    missing_data_df.replace(['', 'NA', 'N/A', 'nan', 'NaN'], np.nan, inplace=True)
+    # Remove spaces in Sample ID and represent missing values as 'NaN'
+    clean_values(final_df)
+    missing_data_df["SNP Name"] = relabel(missing_data_df["SNP Name"], missing_labels_to_nan)
+    missing_data_df["Sample ID"] = relabel(missing_data_df["Sample ID"], missing_labels_to_nan)
+    label_chromosomes(intensities_as_text(final_df))
+    label_chromosomes(intensities_as_text(missing_data_df))
 
-    # Convert NaN values to string 'NaN' for the output
-    final_df = final_df.fillna('NaN')
-    missing_data_df = missing_data_df.fillna('NaN')
+    # NaN values are written as the string 'NaN' in the output (na_rep below)
 
     # Save processed data and missing data report
     with open(output_path, 'w') as f:
         f.writelines(header_lines)  # Write the header lines first
-        final_df.to_csv(f, sep='\t', index=False)  # Then append the final DataFrame
+        final_df.to_csv(f, sep='\t', index=False, na_rep='NaN')  # Then append the final DataFrame
 
-    missing_data_df.to_csv(missing_data_output_path, sep='\t', index=False)
+    missing_data_df.to_csv(missing_data_output_path, sep='\t', index=False, na_rep='NaN')
+
+    print(f"Final report generated and saved to {output_path}")
+    print(f"Missing data report saved to {missing_data_output_path}")
+
+def sorted_run(final_df):
+    # Sort a chunk on its run key: the raw Sample ID ('1' marks a missing one, sorted last)
+    # and the rank of its map record in (Chr, SNP Name) order
+    final_df.insert(0, "_sample", np.where(final_df["Sample ID"].isna(), '1', '0' + final_df["Sample ID"].astype(str)))
+    final_df = final_df.sort_values(by=["_sample", "_rank"], kind="stable")
+    final_df.insert(1, "_rank", final_df.pop("_rank"))
+    clean_values(final_df)
+    return label_chromosomes(intensities_as_text(final_df))
+
+def run_key(line):
+    sample_key, rank, _ = line.split('\t', 2)
+    return sample_key, int(rank)
+
+def merge_runs(run_paths, output, strip_keys):
+    # k-way merge of sorted run files; equal keys keep the run order, as a stable sort would
+    files = [open(path, 'r') for path in run_paths]
+    try:
+        merged = heapq.merge(*files, key=run_key)
+        if strip_keys:
+            output.writelines(line.split('\t', 2)[2] for line in merged)
+        else:
+            output.writelines(merged)
+    finally:
+        for file in files:
+            file.close()
+
+def external_sort_report(report_path, map_path, output_path, missing_data_output_path, memory_budget, tmp_dir=None):
+    # Out-of-core version of read_and_process_data: the report is merged with the map chunk by chunk,
+    # each chunk is sorted into a run file on disk and the runs are k-way merged into the final report.
+    # The missing data report is appended while the chunks are read.
+    header_lines = read_header(report_path)
+    map_df = read_table(map_path, on_bad_lines='skip')
+
+    # Rank of every map record in (Chr, SNP Name) order; sorting by (Sample ID, rank) gives the
+    # same order as sorting the merged rows by (Sample ID, Chr, SNP Name)
+    chr_ranks = chr_sort_ranks(map_df["Chromosome"])
+    map_df = map_df.assign(_chr=chr_ranks[map_df["Chromosome"].to_numpy().astype(int) + 1])
+    map_df = map_df.sort_values(by=["_chr", "Name"], kind="stable").drop(columns="_chr")
+    map_df["_rank"] = np.arange(len(map_df))
+
+    chunk_rows = max(1, memory_budget * 1024 * 1024 // BYTES_PER_ROW)
+    run_dir = tempfile.mkdtemp(prefix='final_report_runs.', dir=tmp_dir or os.path.dirname(os.path.abspath(output_path)))
+    try:
+        run_paths = []
+        with open(missing_data_output_path, 'w') as missing_file:
+            for report_df in iter_final_report(report_path, columns=REPORT_COLUMNS, dtype=pandas_dtypes(),
+                                               chunk_rows=chunk_rows):
+                merged_df = merge_map(apply_schema(report_df), map_df)
+
+                # Identify rows with missing values in key columns
+                missing_data_df = merged_df[KEY_COLUMNS]
+                missing_data_df = missing_data_df[missing_data_df.isnull().any(axis=1)].copy()
+                missing_data_df["SNP Name"] = relabel(missing_data_df["SNP Name"], missing_labels_to_nan)
+                missing_data_df["Sample ID"] = relabel(missing_data_df["Sample ID"], missing_labels_to_nan)
+                label_chromosomes(intensities_as_text(missing_data_df))
+                missing_data_df.to_csv(missing_file, sep='\t', index=False, header=not run_paths, na_rep='NaN')
+
+                final_df = merged_df[KEY_COLUMNS + ["_rank"]].rename(columns={"Chromosome": "Chr"})
+                run_path = os.path.join(run_dir, f"run_{len(run_paths):05d}.txt")
+                sorted_run(final_df).to_csv(run_path, sep='\t', index=False, header=False, na_rep='NaN')
+                run_paths.append(run_path)
+                print(f"Sorted run {len(run_paths)} ({len(final_df)} rows)")
+
+        # Merge in passes so that no more than MAX_MERGE_RUNS files are open at once
+        while len(run_paths) > MAX_MERGE_RUNS:
+            merged_paths = []
+            for i in range(0, len(run_paths), MAX_MERGE_RUNS):
+                merged_path = os.path.join(run_dir, f"merge_{len(run_paths)}_{i:05d}.txt")
+                with open(merged_path, 'w') as merged_file:
+                    merge_runs(run_paths[i:i + MAX_MERGE_RUNS], merged_file, strip_keys=False)
+                for path in run_paths[i:i + MAX_MERGE_RUNS]:
+                    os.remove(path)
+                merged_paths.append(merged_path)
+            run_paths = merged_paths
+
+        with open(output_path, 'w') as f:
+            f.writelines(header_lines)  # Write the header lines first
+            f.write('\t'.join(["Sample ID", "Chr"] + KEY_COLUMNS[2:]) + '\n')
+            merge_runs(run_paths, f, strip_keys=True)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
 
     print(f"Final report generated and saved to {output_path}")
     print(f"Missing data report saved to {missing_data_output_path}")
 
 def main():
     parser = argparse.ArgumentParser(description='Process some files.')
-    parser.add_argument('--report_path', required=True, help='Path to the report file')
+    parser.add_argument('--report_path', required=True, help='Path to the report file (text or columnar cache directory)')
     parser.add_argument('--map_path', required=True, help='Path to the map file')
     parser.add_argument('--output_path', required=True, help='Path to save the final report')
     parser.add_argument('--missing_data_output_path', required=True, help='Path to save the missing data report')
+    parser.add_argument('--memory_budget', type=int, help='Approximate memory budget in MB; sorts the report out of core in runs of this size')
+    parser.add_argument('--tmp_dir', help='Directory for the sorted runs (default: next to the output file)')
 
     args = parser.parse_args()
 
-    read_and_process_data(args.report_path, args.map_path, args.output_path, args.missing_data_output_path)
+    if args.memory_budget:
+        external_sort_report(args.report_path, args.map_path, args.output_path, args.missing_data_output_path,
+                             args.memory_budget, args.tmp_dir)
+    else:
+        read_and_process_data(args.report_path, args.map_path, args.output_path, args.missing_data_output_path)
 
 if __name__ == "__main__":
     main()
@@ -1,72 +1,225 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import shutil
 import argparse
+import numpy as np
 import pandas as pd
+from collections import Counter
+from multiprocessing import Pool
+from final_report_cache import is_cache, read_meta, open_column, label_lookup, write_text_report
 
-def filter_data(final_report_path, qc_individuals_path, qc_snps_path, output_path):
-    # Read file content
-    with open(final_report_path, 'r') as file:
-        lines = file.readlines()
+# Number of bytes read, filtered and written at a time
+BLOCK_SIZE = 64 * 1024 * 1024
 
-    # Separate Header and Data sections
+def update_header(header, num_snps, num_samples):
+    # Update Num SNPs and Num Samples values in the header
+    new_header = []
+    for line in header:
+        if line.startswith("Num SNPs"):
+            new_header.append(f"Num SNPs        {num_snps}\n")
+        elif line.startswith("Num Samples"):
+            new_header.append(f"Num Samples     {num_samples}\n")
+        else:
+            new_header.append(line)
+    return new_header
+
+def read_report_layout(final_report_path):
+    # Return the header lines, the column names and the byte offset where the data rows start
     header = []
-    data_start_index = 0
-    for i, line in enumerate(lines):
-        header.append(line)
-        if line.startswith('[Data]'):
-            data_start_index = i + 1  # The next line after [Data] is the column names
-            break
+    with open(final_report_path, 'rb') as file:
+        for line in iter(file.readline, b''):
+            header.append(line.decode())
+            if line.startswith(b'[Data]'):
+                columns = file.readline().decode().rstrip('\r\n').split("\t")
+                return header, columns, file.tell()
+    raise ValueError(f"No [Data] section found in {final_report_path}")
+
+def split_byte_ranges(final_report_path, data_start, n_parts):
+    # Split the data section into n_parts byte ranges that start and end on line boundaries
+    file_size = os.path.getsize(final_report_path)
+    bounds = [data_start]
+    with open(final_report_path, 'rb') as file:
+        for i in range(1, n_parts):
+            target = data_start + (file_size - data_start) * i // n_parts
+            if target <= bounds[-1]:
+                continue
+            file.seek(target - 1)
+            file.readline()
+            bounds.append(min(file.tell(), file_size))
+    bounds.append(file_size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+def filter_range(final_report_path, start, end, qc_individuals, qc_snps, sample_col, snp_col, output_path):
+    # Filter the rows in [start, end) and append the kept ones to output_path.
+    # Returns kept/dropped row counts per sample and per SNP.
+    counts = {key: Counter() for key in ('sample_kept', 'sample_dropped', 'snp_kept', 'snp_dropped')}
+    max_split = max(sample_col, snp_col) + 1
+
+    def process(lines, outfile):
+        kept_lines, kept_samples, kept_snps, dropped_samples, dropped_snps = [], [], [], [], []
+        for line in lines:
+            parts = line.rstrip(b'\r\n').split(b'\t', max_split)
+            if len(parts) < max_split:
+                continue
+            sample_id, snp_name = parts[sample_col], parts[snp_col]
+            if sample_id in qc_individuals and snp_name in qc_snps:
+                kept_lines.append(line)
+                kept_samples.append(sample_id)
+                kept_snps.append(snp_name)
+            else:
+                dropped_samples.append(sample_id)
+                dropped_snps.append(snp_name)
+        outfile.write(b''.join(kept_lines))
+        counts['sample_kept'].update(kept_samples)
+        counts['snp_kept'].update(kept_snps)
+        counts['sample_dropped'].update(dropped_samples)
+        counts['snp_dropped'].update(dropped_snps)
+
+    with open(final_report_path, 'rb') as infile, open(output_path, 'ab', buffering=BLOCK_SIZE) as outfile:
+        infile.seek(start)
+        remaining = end - start
+        carry = b''
+        while remaining > 0:
+            block = infile.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            block = carry + block
+            cut = block.rfind(b'\n') + 1
+            carry = block[cut:]
+            process(block[:cut].splitlines(keepends=True), outfile)
+        if carry:
+            process([carry], outfile)
+
+    return counts
+
+def merge_counts(all_counts):
+    merged = {key: Counter() for key in all_counts[0]}
+    for counts in all_counts:
+        for key, counter in counts.items():
+            merged[key].update(counter)
+    return merged
+
+def write_counts(counts, counts_prefix):
+    # Per-sample and per-SNP kept/dropped row counts
+    for kind, id_column in (('sample', 'Sample_ID'), ('snp', 'SNP_Name')):
+        kept, dropped = counts[f'{kind}_kept'], counts[f'{kind}_dropped']
+        ids = sorted(set(kept) | set(dropped))
+        counts_df = pd.DataFrame({id_column: ids,
+                                  'kept': [kept.get(i, 0) for i in ids],
+                                  'dropped': [dropped.get(i, 0) for i in ids]})
+        counts_df.to_csv(f"{counts_prefix}_{kind}_counts.txt", sep='\t', index=False)
+
+def filter_cached_data(cache_dir, qc_individuals, qc_snps, output_path):
+    meta = read_meta(cache_dir)
+    new_header = update_header(meta['header'], len(qc_snps), len(qc_individuals))
 
-    # Column names
-    columns = lines[data_start_index].strip().split("\t")
-    data_lines = lines[data_start_index + 1:]
+    # Filter on the memory-mapped integer codes instead of the strings
+    sample_codes, sample_labels = open_column(cache_dir, 'Sample ID', meta)
+    snp_codes, snp_labels = open_column(cache_dir, 'SNP Name', meta)
+    keep_sample = label_lookup(sample_labels, qc_individuals)
+    keep_snp = label_lookup(snp_labels, qc_snps)
 
+    # Count kept and total rows per code while filtering
+    totals = {'sample_kept': np.zeros(len(sample_labels) + 1, dtype=np.int64),
+              'sample_all': np.zeros(len(sample_labels) + 1, dtype=np.int64),
+              'snp_kept': np.zeros(len(snp_labels) + 1, dtype=np.int64),
+              'snp_all': np.zeros(len(snp_labels) + 1, dtype=np.int64)}
+
+    def row_mask(rows):
+        samples, snps = np.asarray(sample_codes[rows]), np.asarray(snp_codes[rows])
+        mask = keep_sample[samples] & keep_snp[snps]
+        # Missing codes (-1) are counted in the last slot
+        for key, codes in (('sample', samples), ('snp', snps)):
+            size = len(totals[f'{key}_all'])
+            totals[f'{key}_all'] += np.bincount(codes % size, minlength=size)
+            totals[f'{key}_kept'] += np.bincount(codes[mask] % size, minlength=size)
+        return mask
+
+    write_text_report(cache_dir, output_path, new_header, row_mask)
+
+    counts = {}
+    for key, labels in (('sample', sample_labels), ('snp', snp_labels)):
+        kept, total = totals[f'{key}_kept'][:-1], totals[f'{key}_all'][:-1]
+        counts[f'{key}_kept'] = Counter({label: int(n) for label, n in zip(labels, kept) if n})
+        counts[f'{key}_dropped'] = Counter({label: int(n) for label, n in zip(labels, total - kept) if n})
+    return counts
+
+def filter_data(final_report_path, qc_individuals_path, qc_snps_path, output_path, workers=1, counts_prefix=None):
     # Read QC passed individual IDs
     with open(qc_individuals_path, 'r') as file:
-        qc_individuals = set(line.strip().split()[0] for line in file)
+        qc_individuals = set(line.strip().split()[0] for line in file if line.strip())
     num_samples = len(qc_individuals)
 
     # Read QC passed SNPs
     with open(qc_snps_path, 'r') as file:
-        qc_snps = set(line.strip() for line in file)
+        qc_snps = set(line.strip() for line in file if line.strip())
     num_snps = len(qc_snps)
 
-    # Update Num SNPs and Num Samples values in the header
-    new_header = []
-    for line in header:
-        if line.startswith("Num SNPs"):
-            new_header.append(f"Num SNPs        {num_snps}\n")
-        elif line.startswith("Num Samples"):
-            new_header.append(f"Num Samples     {num_samples}\n")
+    if is_cache(final_report_path):
+        counts = filter_cached_data(final_report_path, qc_individuals, qc_snps, output_path)
+    else:
+        # Separate Header and Data sections
+        header, columns, data_start = read_report_layout(final_report_path)
+        sample_col, snp_col = columns.index('Sample ID'), columns.index('SNP Name')
+
+        # Write the updated header and column names, then stream the data rows after them
+        with open(output_path, 'w') as file:
+            file.writelines(update_header(header, num_snps, num_samples))
+            file.write("\t".join(columns) + "\n")
+
+        # Rows are compared as bytes, so hash the QC sets as bytes too
+        qc_individuals_b = {sample_id.encode() for sample_id in qc_individuals}
+        qc_snps_b = {snp_name.encode() for snp_name in qc_snps}
+
+        ranges = split_byte_ranges(final_report_path, data_start, max(workers, 1))
+        if workers > 1 and len(ranges) > 1:
+            # Each worker filters one byte range into its own part file; parts are appended in order
+            part_paths = [f"{output_path}.part{i}" for i in range(len(ranges))]
+            # Workers append to their part, so parts left behind by an interrupted run are removed first
+            for part_path in part_paths:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+            tasks = [(final_report_path, start, end, qc_individuals_b, qc_snps_b, sample_col, snp_col, part_path)
+                     for (start, end), part_path in zip(ranges, part_paths)]
+            with Pool(workers) as pool:
+                all_counts = pool.starmap(filter_range, tasks)
+            with open(output_path, 'ab') as outfile:
+                for part_path in part_paths:
+                    with open(part_path, 'rb') as part:
+                        shutil.copyfileobj(part, outfile, BLOCK_SIZE)
+                    os.remove(part_path)
         else:
-            new_header.append(line)
+            all_counts = [filter_range(final_report_path, start, end, qc_individuals_b, qc_snps_b,
+                                       sample_col, snp_col, output_path) for start, end in ranges]
+
+        counts = merge_counts(all_counts)
+        counts = {key: Counter({k.decode(): n for k, n in counter.items()}) for key, counter in counts.items()}
+
+    kept_rows = sum(counts['sample_kept'].values())
+    dropped_rows = sum(counts['sample_dropped'].values())
+    print(f"Rows kept: {kept_rows}, rows dropped: {dropped_rows}")
+    print(f"Samples with kept rows: {len(counts['sample_kept'])}, SNPs with kept rows: {len(counts['snp_kept'])}")
 
-    # Filter data
-    filtered_data_lines = []
-    for line in data_lines:
-        parts = line.split("\t")
-        sample_id = parts[0]
-        snp_name = parts[3]
-        if sample_id in qc_individuals and snp_name in qc_snps:
-            filtered_data_lines.append(line)
-
-    # Write filtered results
-    with open(output_path, 'w') as file:
-        file.writelines(new_header)
-        file.write("\t".join(columns) + "\n")
-        file.writelines(filtered_data_lines)
+    if counts_prefix:
+        write_counts(counts, counts_prefix)
+        print(f"Per-sample and per-SNP counts saved with prefix {counts_prefix}")
 
 def main():
     parser = argparse.ArgumentParser(description='Process and filter final report data.')
-    parser.add_argument('--final_report_path', required=True, help='Path to the final report file')
+    parser.add_argument('--final_report_path', required=True, help='Path to the final report file (text or columnar cache directory)')
     parser.add_argument('--qc_individuals_path', required=True, help='Path to the QC passed individuals file')
     parser.add_argument('--qc_snps_path', required=True, help='Path to the QC passed SNPs file')
     parser.add_argument('--output_path', required=True, help='Path to save the filtered report')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes, each filtering one byte range of the data section')
+    parser.add_argument('--counts_prefix', help='Prefix for per-sample and per-SNP kept/dropped count tables')
 
     args = parser.parse_args()
 
-    filter_data(args.final_report_path, args.qc_individuals_path, args.qc_snps_path, args.output_path)
+    filter_data(args.final_report_path, args.qc_individuals_path, args.qc_snps_path, args.output_path,
+                args.workers, args.counts_prefix)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
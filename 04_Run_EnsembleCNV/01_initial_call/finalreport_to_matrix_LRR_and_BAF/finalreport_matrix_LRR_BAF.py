@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Build chromosome-wise LRR and BAF matrices from a final report as memory-mappable arrays.
+#
+# For every chromosome <chr> the output directory gets
+#     LRR/<chr>.npy, BAF/<chr>.npy   float32 SNP x sample matrices (NaN where a value is missing)
+#     snps/<chr>.txt                 row index: Name and Position of each matrix row, sorted by position
+# plus samples_order.txt (column index, same layout as finalreport_matrix_LRR_BAF.pl),
+# snps_number.txt and SNP_pos.txt. Matrices are opened with open_chr_matrix(), which
+# memory-maps them so that a window of SNPs can be sliced without reading the chromosome.
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from final_report_cache import read_final_report
+
+REPORT_COLUMNS = ['Sample ID', 'SNP Name', 'Chr', 'Position', 'Log R Ratio', 'B Allele Freq']
+REPORT_DTYPES = {'Sample ID': 'category', 'SNP Name': 'category', 'Chr': 'category', 'Position': 'int32',
+                 'Log R Ratio': 'float32', 'B Allele Freq': 'float32'}
+
+def open_chr_matrix(matrix_dir, chr_, kind='LRR'):
+    # Memory-map one chromosome's LRR or BAF matrix with its row (SNP) and column (sample) indices
+    matrix = np.load(os.path.join(matrix_dir, kind, f"{chr_}.npy"), mmap_mode='r')
+    snps = pd.read_csv(os.path.join(matrix_dir, 'snps', f"{chr_}.txt"), sep='\t')
+    samples = pd.read_csv(os.path.join(matrix_dir, 'samples_order.txt'), sep='\t', header=None,
+                          names=['Sample_ID', 'order']).sort_values('order')
+    return matrix, snps, samples['Sample_ID'].tolist()
+
+def build_matrices(report_path, output_dir):
+    report = read_final_report(report_path, columns=REPORT_COLUMNS, dtype=REPORT_DTYPES)
+    for kind in ('LRR', 'BAF', 'snps'):
+        os.makedirs(os.path.join(output_dir, kind), exist_ok=True)
+
+    # Samples are columns, in order of first appearance in the report
+    sample_codes, sample_ids = pd.factorize(report['Sample ID'].astype(str))
+    n_samples = len(sample_ids)
+    with open(os.path.join(output_dir, 'samples_order.txt'), 'w') as file:
+        file.writelines(f"{sample_id}\t{order}\n" for order, sample_id in enumerate(sample_ids, start=1))
+
+    # One row per distinct SNP, indexed by its code (first record wins), chromosomes in numeric order
+    snp_codes, snp_labels = pd.factorize(report['SNP Name'].astype(str))
+    first = np.unique(snp_codes, return_index=True)[1]
+    chr_by_code = report['Chr'].astype(str).to_numpy()[first]
+    snp_table = pd.DataFrame({'Name': snp_labels, 'Chr': chr_by_code, 'Position': report['Position'].to_numpy()[first]})
+    snp_table['chr_order'] = pd.to_numeric(snp_table['Chr'], errors='coerce')
+    snp_table = snp_table.sort_values(['chr_order', 'Chr', 'Position', 'Name'], kind='stable')
+    snp_table[['Name', 'Chr', 'Position']].to_csv(os.path.join(output_dir, 'SNP_pos.txt'), sep='\t', index=False)
+
+    chr_of_record = chr_by_code[snp_codes]
+    lrr = report['Log R Ratio'].to_numpy(dtype=np.float32)
+    baf = report['B Allele Freq'].to_numpy(dtype=np.float32)
+
+    snp_numbers = []
+    for chr_, chr_snps in snp_table.groupby('Chr', sort=False):
+        rows = np.flatnonzero(chr_of_record == chr_)
+
+        # Matrix row of every SNP code on this chromosome
+        snp_row_of_code = np.full(len(snp_labels), -1)
+        snp_row_of_code[chr_snps.index.to_numpy()] = np.arange(len(chr_snps))
+        snp_rows = snp_row_of_code[snp_codes[rows]]
+        sample_cols = sample_codes[rows]
+
+        chr_snps[['Name', 'Position']].to_csv(os.path.join(output_dir, 'snps', f"{chr_}.txt"), sep='\t', index=False)
+        snp_numbers.append((chr_, len(chr_snps)))
+
+        # Scatter every record of this chromosome into its SNP x sample cell
+        for kind, values in (('LRR', lrr), ('BAF', baf)):
+            matrix = np.lib.format.open_memmap(os.path.join(output_dir, kind, f"{chr_}.npy"), mode='w+',
+                                               dtype=np.float32, shape=(len(chr_snps), n_samples))
+            matrix[:] = np.nan
+            matrix[snp_rows, sample_cols] = values[rows]
+            matrix.flush()
+            del matrix
+
+        # Every sample is expected to have one record per probe
+        filled = np.bincount(sample_cols, minlength=n_samples)
+        if (filled != len(chr_snps)).any():
+            print(f"Warning: chr {chr_}: {np.sum(filled != len(chr_snps))} samples do not have exactly "
+                  f"{len(chr_snps)} probes; missing cells are NaN")
+        print(f"chr: {chr_}\t\tnumber of probes: {len(chr_snps)}")
+
+    pd.DataFrame(snp_numbers).to_csv(os.path.join(output_dir, 'snps_number.txt'), sep='\t', index=False, header=False)
+
+    print(f"number of samples: {n_samples}")
+    print(f"LRR and BAF matrices saved to {output_dir}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Build chromosome-wise memory-mappable LRR and BAF matrices from a final report.')
+    parser.add_argument('report_path', type=str, help='Path to the final report (text or columnar cache directory)')
+    parser.add_argument('output_dir', type=str, help='Directory to save the matrices and index files')
+
+    args = parser.parse_args()
+
+    build_matrices(args.report_path, args.output_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Split a final report into one PennCNV signal intensity file per sample.
+# Python counterpart of finalreport_to_PennCNV.pl: the report (text or columnar
+# cache) is read once and the per-sample files are written by a process pool.
+
+import re
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+from final_report_cache import is_cache, read_text_header, read_final_report
+
+# Chromosomes skipped by finalreport_to_PennCNV.pl
+SKIPPED_CHR = re.compile(r'^0|XY|Y|MT')
+
+# Per-sample-grouped report table, set in every worker by init_worker (inherited without a copy under fork,
+# sent once per worker under spawn/forkserver)
+_report = None
+
+def init_worker(report):
+    global _report
+    _report = report
+
+def write_sample_file(task):
+    sample_id, start, end, output_path, columns = task
+    rows = _report.iloc[start:end]
+    with open(output_path, 'w') as file:
+        file.write('\t'.join(columns + [f"{sample_id}.Log R Ratio", f"{sample_id}.B Allele Freq"]) + '\n')
+        rows.to_csv(file, sep='\t', header=False, index=False, na_rep='NaN')
+    return output_path
+
+def split_report(report_path, prefix='', suffix='', tolerate=False, workers=1, list_file=None):
+    columns = ['Sample ID', 'SNP Name', 'Chr', 'Position', 'Log R Ratio', 'B Allele Freq']
+    if is_cache(report_path):
+        report = read_final_report(report_path, columns=columns)
+    else:
+        # Text values are passed through unchanged
+        header_lines = read_text_header(report_path)
+        report = pd.read_csv(report_path, sep='\t', skiprows=len(header_lines), usecols=columns, dtype=str,
+                             keep_default_na=False)
+    n_lines = len(report)
+
+    # Drop non-autosomal chromosomes (matching the distinct labels only) and rows without a sample ID
+    skipped_chr = [chr_ for chr_ in pd.unique(report['Chr'].astype(str)) if SKIPPED_CHR.search(chr_)]
+    report = report[~report['Chr'].astype(str).isin(skipped_chr)]
+    sample_ids = report['Sample ID'].astype(str).str.strip()
+    report = report[(sample_ids != '') & report['Sample ID'].notna()]
+
+    # Text rows cut short before LRR or BAF, or with an empty LRR/BAF field, are skipped with --tolerate,
+    # otherwise they are an error (NaN values are kept and written as 'NaN')
+    missing = pd.Series(False, index=report.index)
+    if not is_cache(report_path):
+        for column in ['Log R Ratio', 'B Allele Freq']:
+            missing |= report[column].isna() | (report[column].str.strip() == '')
+    if missing.any():
+        if not tolerate:
+            raise ValueError(f"{missing.sum()} rows lack LRR or BAF information in {report_path}; use --tolerate to skip them")
+        print(f"WARNING: Skipping {missing.sum()} rows due to lack of LRR/BAF information", file=sys.stderr)
+        report = report[~missing]
+
+    # Group rows by sample (keeping the report order inside each sample) and find each sample's slice
+    sample_codes, sample_labels = pd.factorize(report['Sample ID'].astype(str))
+    order = np.argsort(sample_codes, kind='stable')
+    grouped = report.iloc[order][['SNP Name', 'Chr', 'Position', 'Log R Ratio', 'B Allele Freq']]
+    bounds = np.searchsorted(sample_codes[order], np.arange(len(sample_labels) + 1))
+
+    output_columns = ['Name', 'Chr', 'Position']
+    tasks = [(sample_id, bounds[i], bounds[i + 1], f"{prefix}{sample_id}{suffix}", output_columns)
+             for i, sample_id in enumerate(sample_labels)]
+
+    if workers > 1:
+        with Pool(workers, initializer=init_worker, initargs=(grouped,)) as pool:
+            output_paths = pool.map(write_sample_file, tasks, chunksize=max(1, len(tasks) // (workers * 8)))
+    else:
+        init_worker(grouped)
+        output_paths = [write_sample_file(task) for task in tasks]
+
+    # List of signal files used by compile_pfb.pl
+    if list_file:
+        with open(list_file, 'w') as file:
+            file.writelines(f"{path}\n" for path in output_paths)
+
+    print(f"NOTICE: Finished processing {n_lines} lines in report file {report_path}, "
+          f"and generated {len(output_paths)} output signal intensity files", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description='Split a final report into per-sample PennCNV signal intensity files.')
+    parser.add_argument('report_path', type=str, help='Path to the final report (text or columnar cache directory)')
+    parser.add_argument('--prefix', type=str, default='', help='Prefix of output file names')
+    parser.add_argument('--suffix', type=str, default='', help='Suffix of output file names')
+    parser.add_argument('--tolerate', action='store_true', help='Skip records without LRR/BAF information instead of failing')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes writing sample files')
+    parser.add_argument('--list_file', type=str, help='Path to write the list of generated files (e.g. list_pfb.txt)')
+
+    args = parser.parse_args()
+
+    split_report(args.report_path, args.prefix, args.suffix, args.tolerate, args.workers, args.list_file)
+
+if __name__ == "__main__":
+    main()
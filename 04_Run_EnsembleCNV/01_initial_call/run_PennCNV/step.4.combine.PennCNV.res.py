@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+# Combine the per-sample PennCNV results (.rawcnv and .log files) of a result directory.
+# Python counterpart of step.4.combine.PennCNV.res.pl: the sample folders are read and
+# parsed by a process pool, and besides CNV.PennCNV.rawcnv and CNV.PennCNV.log the
+# formatted CNV table and a per-sample QC table can be written in the same run.
+
+import os
+import re
+import sys
+import argparse
+import pandas as pd
+from multiprocessing import Pool
+from penncnv_results import parse_rawcnv, parse_qc, add_cnv_counts, count_call_lines
+
+def read_sample(task):
+    # Contents of one sample folder (<in_dir>/<folder>/<folder>.rawcnv and .log) and their parsed tables
+    in_dir, folder, sample_pattern = task
+    with open(os.path.join(in_dir, folder, f"{folder}.rawcnv"), 'r') as file:
+        rawcnv = file.read()
+    with open(os.path.join(in_dir, folder, f"{folder}.log"), 'r') as file:
+        log = file.read()
+    cnv_df = parse_rawcnv(rawcnv, sample_pattern)
+    return rawcnv, log, cnv_df, parse_qc(log, sample_pattern), count_call_lines(rawcnv) - len(cnv_df)
+
+def combine_results(in_dir, out_dir, table_output=None, qc_output=None, sample_pattern=None, workers=1):
+    folders = sorted(folder for folder in os.listdir(in_dir) if not folder.startswith('.'))
+    sample_pattern = re.compile(sample_pattern) if sample_pattern else None
+    tasks = [(in_dir, folder, sample_pattern) for folder in folders]
+
+    if workers > 1:
+        with Pool(workers) as pool:
+            results = pool.map(read_sample, tasks, chunksize=max(1, len(tasks) // (workers * 8)))
+    else:
+        results = [read_sample(task) for task in tasks]
+
+    # Concatenated files, in sample folder order
+    with open(os.path.join(out_dir, 'CNV.PennCNV.rawcnv'), 'w') as out_rawcnv, \
+            open(os.path.join(out_dir, 'CNV.PennCNV.log'), 'w') as out_log:
+        for rawcnv, log, _, _, _ in results:
+            out_rawcnv.write(rawcnv)
+            out_log.write(log)
+
+    cnv_df = pd.concat([result[2] for result in results], ignore_index=True)
+    n_unparsed = sum(result[4] for result in results)
+    if n_unparsed:
+        print(f"WARNING: {n_unparsed} rawcnv lines could not be parsed and were left out of the CNV table", file=sys.stderr)
+    if table_output:
+        cnv_df.to_csv(table_output, sep='\t', index=False)
+    if qc_output:
+        qc_df = add_cnv_counts(pd.concat([result[3] for result in results], ignore_index=True), cnv_df)
+        qc_df.to_csv(qc_output, sep='\t', index=False)
+
+    print(f"Analysis completed! {len(folders)} samples and {len(cnv_df)} CNV calls combined in {out_dir}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Combine per-sample PennCNV .rawcnv and .log files.')
+    parser.add_argument('--in_dir', type=str, required=True, help='Directory with one result folder per sample')
+    parser.add_argument('--out_dir', type=str, required=True, help='Directory to write CNV.PennCNV.rawcnv and CNV.PennCNV.log into')
+    parser.add_argument('--table_output', type=str, help='Path to also write the formatted CNV table')
+    parser.add_argument('--qc_output', type=str, help='Path to also write the per-sample QC table from the logs')
+    parser.add_argument('--sample_pattern', type=str, help='Regular expression picking the sample ID out of the signal file path '
+                                                           '(default: the file name)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes reading sample folders')
+
+    args = parser.parse_args()
+
+    combine_results(args.in_dir, args.out_dir, args.table_output, args.qc_output, args.sample_pattern, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,31 @@
 #!/usr/bin/env python3
 
 import pandas as pd
+import numpy as np
 import argparse
+from interval_index import build_index, contain_pairs, first_match
 
-def determine_cnvr_type(cn_values):
-    cn_values_set = set(cn_values)
-    if cn_values_set.issubset({0, 1}):
-        return 'Loss'
-    elif cn_values_set.issubset({3}):
-        return 'Gain'
-    elif cn_values_set.intersection({0, 1}) and cn_values_set.intersection({3}):
-        return 'Mixed'
-    else:
-        return 'Undefined'
+def determine_cnvr_types(n_cnv, n_loss, n_gain):
+    # CN-set typing from per-CNVR counts: all CNs in {0, 1} is a Loss, all CNs equal to 3 a Gain,
+    # both present is Mixed; anything else (including CNVRs without CNVs) is Undefined
+    return np.select([n_cnv == 0, n_loss == n_cnv, n_gain == n_cnv, (n_loss > 0) & (n_gain > 0)],
+                     ['Undefined', 'Loss', 'Gain', 'Mixed'], default='Undefined')
 
 def merge_overlapping_cnvr(cnvr_df):
-    merged_cnvr = []
-    current_cnvr = None
+    # Sweep line over CNVRs sorted by chromosome and start: a CNVR starts a new group when it is the first
+    # on its chromosome or starts after the running maximum posEnd of the CNVRs before it
+    running_end = cnvr_df.groupby('chr', sort=False)['posEnd'].cummax()
+    previous_end = running_end.groupby(cnvr_df['chr'], sort=False).shift()
+    starts_group = (previous_end.isna() | (cnvr_df['posStart'] > previous_end)).to_numpy()
+    group = np.cumsum(starts_group)
+    ends_group = np.append(starts_group[1:], True)
 
-    for index, row in cnvr_df.iterrows():
-        if current_cnvr is None:
-            current_cnvr = row
-        else:
-            if row['chr'] == current_cnvr['chr'] and row['posStart'] <= current_cnvr['posEnd']:
-                current_cnvr['posEnd'] = max(current_cnvr['posEnd'], row['posEnd'])
-                current_cnvr['end_snp'] = row['end_snp']
-            else:
-                merged_cnvr.append(current_cnvr)
-                current_cnvr = row
+    # A merged CNVR keeps the first CNVR's fields, the furthest posEnd and the end_snp of its last CNVR
+    merged_cnvr = cnvr_df[starts_group].reset_index(drop=True)
+    merged_cnvr['posEnd'] = cnvr_df.groupby(group, sort=False)['posEnd'].max().to_numpy()
+    merged_cnvr['end_snp'] = cnvr_df['end_snp'].to_numpy()[ends_group]
 
-    if current_cnvr is not None:
-        merged_cnvr.append(current_cnvr)
-
-    return pd.DataFrame(merged_cnvr)
+    return merged_cnvr
 
 def main(cnvr_file_path, cnv_file_path, output_file_path):
     try:
@@ -50,28 +43,18 @@ def main(cnvr_file_path, cnv_file_path, output_file_path):
     # Merge overlapping CNVRs
     cnvr_df = merge_overlapping_cnvr(cnvr_df)
 
-    result = []
-
-    for index, cnvr_row in cnvr_df.iterrows():
-        cnvr_chr = cnvr_row['chr']
-        cnvr_start = cnvr_row['posStart']
-        cnvr_end = cnvr_row['posEnd']
-        start_snp = cnvr_row['start_snp']
-        end_snp = cnvr_row['end_snp']
-
-        cnv_in_cnvr = cnv_df[(cnv_df['chr'] == cnvr_chr) & 
-                             (cnv_df['posStart'] >= cnvr_start) & 
-                             (cnv_df['posEnd'] <= cnvr_end)]
-
-        if not cnv_in_cnvr.empty:
-            cn_values = cnv_in_cnvr['CN'].tolist()
-            cnvr_type = determine_cnvr_type(cn_values)
-        else:
-            cnvr_type = 'Undefined'
+    # Assign every CNV to the merged CNVR containing it (merged CNVRs do not overlap, so there is at most one)
+    cnvr_index = build_index(cnvr_df['chr'], cnvr_df['posStart'], cnvr_df['posEnd'])
+    assignment = first_match(contain_pairs(cnvr_index, cnv_df['chr'], cnv_df['posStart'], cnv_df['posEnd']), len(cnv_df))
 
-        result.append([cnvr_row['CNVR_ID'], cnvr_row['chr'], cnvr_row['arm'], cnvr_row['posStart'], cnvr_row['posEnd'], start_snp, end_snp, cnvr_type])
+    # Count CNVs, losses and gains per CNVR in a single grouped aggregation and type each CNVR
+    cn = cnv_df['CN'].to_numpy()
+    flags = pd.DataFrame({'cnvr': assignment, 'loss': np.isin(cn, [0, 1]), 'gain': cn == 3})[assignment >= 0]
+    counts = flags.groupby('cnvr').agg(n_cnv=('loss', 'size'), n_loss=('loss', 'sum'), n_gain=('gain', 'sum'))
+    counts = counts.reindex(range(len(cnvr_df)), fill_value=0)
 
-    result_df = pd.DataFrame(result, columns=['CNVR_ID', 'chr', 'arm', 'posStart', 'posEnd', 'start_snp', 'end_snp', 'Type'])
+    result_df = cnvr_df[['CNVR_ID', 'chr', 'arm', 'posStart', 'posEnd', 'start_snp', 'end_snp']].copy()
+    result_df['Type'] = determine_cnvr_types(counts['n_cnv'], counts['n_loss'], counts['n_gain'])
     try:
         result_df.to_csv(output_file_path, index=False, sep='\t', encoding='utf-8')
         print("CNVR types have been successfully determined and saved to:", output_file_path)
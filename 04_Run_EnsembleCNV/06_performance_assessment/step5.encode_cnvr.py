@@ -1,9 +1,20 @@
 #!/usr/bin/env python3
 
 import pandas as pd
+import numpy as np
 import argparse
-
-def main(cnvr_types_path, cnv_path, inconsistent_cnvr_samples_path, encoded_results_path, final_samples_path):
+from scipy import sparse
+from interval_index import build_index, contain_pairs
+from cnvr_matrix import save_encoded_matrix, to_long
+
+def encode_cn_values(n_values, all_loss, single_value):
+    # Encoding of each (CNVR, sample) group from its distinct CN values: only 0/1 is -1 (loss),
+    # a single CN of 2 is 0, any other single CN is 1 (gain); several distinct CNs are inconsistent (NaN)
+    encoded = np.where(single_value == 2, 0.0, 1.0)
+    encoded = np.where(n_values > 1, np.nan, encoded)
+    return np.where(all_loss, -1.0, encoded)
+
+def main(cnvr_types_path, cnv_path, inconsistent_cnvr_samples_path, encoded_matrix_prefix, final_samples_path, long_output_path=None):
     # Read the data files
     cnvr_df = pd.read_csv(cnvr_types_path, sep='\t')
     cnv_df = pd.read_csv(cnv_path, sep='\t')
@@ -11,70 +22,41 @@ def main(cnvr_types_path, cnv_path, inconsistent_cnvr_samples_path, encoded_resu
     # Filter out CNVRs of type 'Mixed'
     cnvr_df = cnvr_df[cnvr_df['Type'] != 'Mixed']
 
-    # Create CNVR position dictionary
-    cnvr_dict = {(row['chr'], row['posStart'], row['posEnd']): row['CNVR_ID'] for _, row in cnvr_df.iterrows()}
-
-    # Find all unique CNVR_IDs and Sample_IDs
-    all_cnvr_ids = cnvr_df['CNVR_ID'].unique()
-    all_sample_ids = cnv_df['Sample_ID'].unique()
-
-    # Initialize result dictionary with all samples and CNVRs set to 0
-    encoded_results_dict = {sample: {cnvr: 0 for cnvr in all_cnvr_ids} for sample in all_sample_ids}
-
-    # Function to encode CN values
-    def encode_cn_value(cn_values):
-        if set(cn_values).issubset({0, 1}):  # Both 0 and 1 should be treated as -1
-            return -1
-        if len(cn_values) == 1:
-            cn_value = cn_values[0]
-            if cn_value in [0, 1]:
-                return -1
-            elif cn_value == 2:
-                return 0
-            else:
-                return 1
-        return None  # Indicate inconsistency
-
-    # Vectorized operation to map CNVRs
-    cnv_df['encoded_value'] = cnv_df.groupby(['chr', 'posStart', 'posEnd'])['CN'].transform(lambda x: encode_cn_value(x.tolist()))
-
-    inconsistent_cnvr_samples = []
-
-    # Encode CNVRs
-    for _, cnvr_row in cnvr_df.iterrows():
-        mask = (cnv_df['chr'] == cnvr_row['chr']) & (cnv_df['posStart'] >= cnvr_row['posStart']) & (cnv_df['posEnd'] <= cnvr_row['posEnd'])
-        filtered_cnv_df = cnv_df[mask]
-
-        if not filtered_cnv_df.empty:
-            grouped = filtered_cnv_df.groupby('Sample_ID')
-            for sample_id, group in grouped:
-                encoded_value = encode_cn_value(group['CN'].unique())
-                if encoded_value is not None:  # Only set if consistent
-                    encoded_results_dict[sample_id][cnvr_row['CNVR_ID']] = encoded_value
-
-    # Check consistency
-    for _, cnvr_row in cnvr_df.iterrows():
-        mask = (cnv_df['chr'] == cnvr_row['chr']) & (cnv_df['posStart'] >= cnvr_row['posStart']) & (cnv_df['posEnd'] <= cnvr_row['posEnd'])
-        filtered_cnv_df = cnv_df[mask]
-
-        if not filtered_cnv_df.empty:
-            grouped = filtered_cnv_df.groupby('Sample_ID')
-            for sample_id, group in grouped:
-                cn_values = group['CN'].unique()
-                if len(cn_values) > 1 and set(cn_values).issubset({0, 1}):
-                    # Both 0 and 1 present, treat as -1
-                    encoded_results_dict[sample_id][cnvr_row['CNVR_ID']] = -1
-                elif len(cn_values) > 1:
-                    inconsistent_cnvr_samples.append((cnvr_row['CNVR_ID'], sample_id))
-
-    # Save inconsistent CNVRs and samples to file
-    inconsistent_df = pd.DataFrame(inconsistent_cnvr_samples, columns=['CNVR_ID', 'Sample_ID'])
-    inconsistent_df.to_csv(inconsistent_cnvr_samples_path, sep='\t', index=False)
-
-    # Transform the encoded results into a DataFrame
-    encoded_results = [(sample, cnvr, encoded_value) for sample, cnvrs in encoded_results_dict.items() for cnvr, encoded_value in cnvrs.items()]
-    encoded_df = pd.DataFrame(encoded_results, columns=['Sample_ID', 'CNVR_ID', 'Encoded_Value'])
-    encoded_df.to_csv(encoded_results_path, sep='\t', index=False)
+    # Find all unique CNVR_IDs and Sample_IDs (matrix columns and rows)
+    cnvr_codes, all_cnvr_ids = pd.factorize(cnvr_df['CNVR_ID'])
+    sample_codes, all_sample_ids = pd.factorize(cnv_df['Sample_ID'])
+
+    # CNVs contained in each CNVR, found once with the interval index
+    cnvr_index = build_index(cnvr_df['chr'], cnvr_df['posStart'], cnvr_df['posEnd'])
+    cnv_rows, cnvr_rows = contain_pairs(cnvr_index, cnv_df['chr'], cnv_df['posStart'], cnv_df['posEnd'])
+
+    # One grouped pass over the (CNVR, sample) groups: the distinct CN values of each group give both
+    # its encoding and whether it is inconsistent
+    cn = cnv_df['CN'].to_numpy()[cnv_rows]
+    calls = pd.DataFrame({'cnvr': cnvr_rows, 'sample': sample_codes[cnv_rows], 'CN': cn, 'loss': np.isin(cn, [0, 1])})
+    calls = calls[calls['sample'] >= 0]
+    groups = calls.groupby(['cnvr', 'sample']).agg(n_values=('CN', 'nunique'), all_loss=('loss', 'all'),
+                                                   single_value=('CN', 'first')).reset_index()
+    groups['encoded'] = encode_cn_values(groups['n_values'], groups['all_loss'], groups['single_value'])
+
+    # Save inconsistent CNVRs and samples to file (CNVRs in file order, samples sorted within a CNVR)
+    inconsistent = groups[groups['encoded'].isna()].copy()
+    inconsistent['CNVR_ID'] = cnvr_df['CNVR_ID'].to_numpy()[inconsistent['cnvr']]
+    inconsistent['Sample_ID'] = all_sample_ids[inconsistent['sample']]
+    inconsistent = inconsistent.sort_values(['cnvr', 'Sample_ID'], kind='stable')
+    inconsistent[['CNVR_ID', 'Sample_ID']].to_csv(inconsistent_cnvr_samples_path, sep='\t', index=False)
+
+    # Consistent calls fill the sparse sample x CNVR matrix; a CNVR_ID listed twice keeps its last CNVR's call
+    encoded = groups[groups['encoded'].notna() & (groups['encoded'] != 0)].copy()
+    encoded['column'] = cnvr_codes[encoded['cnvr']]
+    encoded = encoded.drop_duplicates(subset=['sample', 'column'], keep='last')
+    matrix = sparse.csr_matrix((encoded['encoded'].to_numpy(dtype=np.int8), (encoded['sample'], encoded['column'])),
+                               shape=(len(all_sample_ids), len(all_cnvr_ids)), dtype=np.int8)
+    save_encoded_matrix(encoded_matrix_prefix, matrix, all_sample_ids, all_cnvr_ids)
+
+    # Optional long-format export with one line per sample x CNVR cell
+    if long_output_path:
+        to_long(matrix, all_sample_ids, all_cnvr_ids).to_csv(long_output_path, sep='\t', index=False)
 
     # Save the sample list to final_samples.txt
     sample_list_df = pd.DataFrame(all_sample_ids, columns=['Sample_ID'])
@@ -87,9 +69,11 @@ if __name__ == "__main__":
     parser.add_argument('cnvr_types_path', type=str, help='Path to the final CNVR types file')
     parser.add_argument('cnv_path', type=str, help='Path to the final CNV file')
     parser.add_argument('inconsistent_cnvr_samples_path', type=str, help='Path to save inconsistent CNVR samples')
-    parser.add_argument('encoded_results_path', type=str, help='Path to save encoded results')
+    parser.add_argument('encoded_matrix_prefix', type=str, help='Prefix of the sparse encoded matrix (.npz) and its sample/CNVR index files')
     parser.add_argument('final_samples_path', type=str, help='Path to save final sample list')
+    parser.add_argument('--long_output', type=str, help='Also save the encoded results as a long table (Sample_ID, CNVR_ID, Encoded_Value)')
 
     args = parser.parse_args()
 
-    main(args.cnvr_types_path, args.cnv_path, args.inconsistent_cnvr_samples_path, args.encoded_results_path, args.final_samples_path)
+    main(args.cnvr_types_path, args.cnv_path, args.inconsistent_cnvr_samples_path, args.encoded_matrix_prefix, args.final_samples_path,
+         args.long_output)
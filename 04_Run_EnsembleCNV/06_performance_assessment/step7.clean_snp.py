@@ -2,50 +2,81 @@
 
 import pandas as pd
 import argparse
+from final_report_cache import iter_final_report
+from genotype_schema import pandas_dtypes, apply_schema, read_table, encode_chr, label_chromosomes
+from interval_index import build_index, point_pairs, first_match
 
-def main(cnvr_file_path, snp_file_path, final_samples_file_path, output_file_path):
-    # Read CNVR file
-    cnvr_df = pd.read_csv(cnvr_file_path, sep='\t')
+PROBE_COLUMNS = ['SNP Name', 'Chr', 'Position']
 
-    # Read SNP file, skipping the header
-    snp_df = pd.read_csv(snp_file_path, sep='\t', comment='[', skiprows=9)
+def read_probes(snp_file_path, snp_map_path=None):
+    # One row per probe (SNP Name, Chr code, Position), from the SNP map if given, otherwise from the
+    # distinct probes of the report (reading only those three columns)
+    if snp_map_path:
+        probes = read_table(snp_map_path, columns=['Name', 'Chromosome', 'Position'])
+        probes = probes.rename(columns={'Name': 'SNP Name', 'Chromosome': 'Chr'})[PROBE_COLUMNS]
+    else:
+        probes = pd.concat([apply_schema(chunk).drop_duplicates(subset='SNP Name')
+                            for chunk in iter_final_report(snp_file_path, columns=PROBE_COLUMNS, dtype=pandas_dtypes())])
+        probes['SNP Name'] = probes['SNP Name'].astype(str)
+    return probes.drop_duplicates(subset='SNP Name').reset_index(drop=True)
 
-    # Filter out SNPs not on chromosomes 1-26
-    snp_df = snp_df[snp_df['Chr'].astype(str).isin([str(i) for i in range(1, 27)])]
+def cnvr_probes(cnvr_df, probes):
+    # Probes on chromosomes 1-26 lying inside a CNVR, with the first CNVR (in file order) containing each
+    probes = probes[probes['Chr'].isin(range(1, 27))]
+    cnvr_index = build_index(encode_chr(cnvr_df['chr']), cnvr_df['posStart'], cnvr_df['posEnd'])
+    match = first_match(point_pairs(cnvr_index, probes['Chr'], probes['Position']), len(probes))
+    probes = probes[match >= 0].copy()
+    probes['CNVR_ID'] = cnvr_df['CNVR_ID'].to_numpy()[match[match >= 0]]
+    return probes
+
+def main(cnvr_file_path, snp_file_path, final_samples_file_path, output_file_path,
+         snp_map_path=None, probes_only=False, samples_file_path=None):
+    # Read CNVR file
+    cnvr_df = pd.read_csv(cnvr_file_path, sep='\t')
 
     # Read final_samples.txt to get the list of sample IDs
     with open(final_samples_file_path, 'r') as file:
         final_samples = file.read().splitlines()
     final_samples = final_samples[1:]  # Skip the header
 
-    # Filter SNPs to keep only those in the final sample list
-    snp_df = snp_df[snp_df['Sample ID'].isin(final_samples)]
-
-    # Initialize an empty DataFrame to store the filtered SNPs
-    filtered_snps_df = pd.DataFrame()
-
-    # Filter SNPs using vectorized operations
-    for _, cnvr in cnvr_df.iterrows():
-        chr_match = snp_df['Chr'].astype(str) == str(cnvr['chr'])
-        pos_in_range = (snp_df['Position'] >= cnvr['posStart']) & (snp_df['Position'] <= cnvr['posEnd'])
-        filtered_snps = snp_df[chr_match & pos_in_range]
-        filtered_snps_df = pd.concat([filtered_snps_df, filtered_snps])
+    # Whether a SNP lies inside a CNVR depends only on the probe, so the in-CNVR probe set is computed once
+    in_cnvr = cnvr_probes(cnvr_df, read_probes(snp_file_path, snp_map_path))
+    in_cnvr_names = pd.Index(in_cnvr['SNP Name'])
 
-    # Drop duplicates if any SNPs fall within multiple CNVRs
-    filtered_snps_df = filtered_snps_df.drop_duplicates()
+    if probes_only:
+        # Probe list plus the final samples found in the report, instead of the expanded samples x probes table
+        label_chromosomes(in_cnvr).to_csv(output_file_path, sep='\t', index=False)
+        samples = pd.unique(pd.concat([chunk['Sample ID'].astype(str).drop_duplicates()
+                                       for chunk in iter_final_report(snp_file_path, columns=['Sample ID'], dtype=str)]))
+        final_sample_set = set(final_samples)
+        samples = [sample for sample in samples if sample in final_sample_set]
+        pd.DataFrame({'Sample_ID': samples}).to_csv(samples_file_path, sep='\t', index=False)
+        print(f"{len(in_cnvr)} probes inside CNVRs saved to {output_file_path} and {len(samples)} samples to {samples_file_path}")
+        return
 
-    # Save the filtered SNPs to a new file
-    filtered_snps_df.to_csv(output_file_path, sep='\t', index=False)
+    # Stream the SNP file (text final report or columnar cache) through the probe set, writing each chunk as it goes
+    with open(output_file_path, 'w') as output:
+        for i, snp_df in enumerate(iter_final_report(snp_file_path, dtype=pandas_dtypes())):
+            snp_df = apply_schema(snp_df)
+            keep = (snp_df['Chr'].isin(range(1, 27)) & snp_df['Sample ID'].isin(final_samples)
+                    & snp_df['SNP Name'].isin(in_cnvr_names))
+            label_chromosomes(snp_df[keep].copy()).to_csv(output, sep='\t', index=False, header=i == 0)
 
     print(f"Filtered SNPs have been saved to {output_file_path}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Filter SNPs based on CNVRs and sample IDs, and save the results.')
     parser.add_argument('cnvr_file_path', type=str, help='Path to the CNVR file')
-    parser.add_argument('snp_file_path', type=str, help='Path to the SNP file')
+    parser.add_argument('snp_file_path', type=str, help='Path to the SNP file (final report or its columnar cache directory)')
     parser.add_argument('final_samples_file_path', type=str, help='Path to the final samples file')
     parser.add_argument('output_file_path', type=str, help='Path to the output file')
+    parser.add_argument('--snp_map', type=str, help='SNP map (Name, Chromosome, Position) to take probe positions from instead of the SNP file')
+    parser.add_argument('--probes_only', action='store_true', help='Write only the in-CNVR probe list and a sample list')
+    parser.add_argument('--samples_file', type=str, help='Path to the sample list written with --probes_only')
 
     args = parser.parse_args()
+    if args.probes_only and not args.samples_file:
+        parser.error("--samples_file is required with --probes_only")
 
-    main(args.cnvr_file_path, args.snp_file_path, args.final_samples_file_path, args.output_file_path)
+    main(args.cnvr_file_path, args.snp_file_path, args.final_samples_file_path, args.output_file_path,
+         args.snp_map, args.probes_only, args.samples_file)
@@ -1,70 +1,120 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-
-import pandas as pd
-import numpy as np
-import argparse
-
-def calculate_summary_stats(df, snp_df):
-    summary = {}
-    summary['Total length (Mb)'] = df['posEnd'].sub(df['posStart']).sum() / 1e6
-    summary['Total number of CNVR'] = len(df)
-    summary['Number of CNVR (< 10 kb)'] = len(df[(df['posEnd'] - df['posStart']) < 10 * 1e3])
-    summary['Number of CNVR (10-50 kb)'] = len(df[(df['posEnd'] - df['posStart']).between(10 * 1e3, 50 * 1e3)])
-    summary['Number of CNVR (50-100 kb)'] = len(df[(df['posEnd'] - df['posStart']).between(50 * 1e3, 100 * 1e3)])
-    summary['Number of CNVR (100-500 kb)'] = len(df[(df['posEnd'] - df['posStart']).between(100 * 1e3, 500 * 1e3)])
-    summary['Number of CNVR (500 kb-1 Mb)'] = len(df[(df['posEnd'] - df['posStart']).between(500 * 1e3, 1 * 1e6)])
-    summary['Number of CNVR (>= 1 Mb)'] = len(df[(df['posEnd'] - df['posStart']) >= 1 * 1e6])
-    
-    # Calculate the average number of SNPs per CNVR
-    snp_counts = []
-    for _, cnvr in df.iterrows():
-        chr_match = snp_df['Chr'].astype(str) == str(cnvr['chr'])
-        pos_in_range = (snp_df['Position'] >= cnvr['posStart']) & (snp_df['Position'] <= cnvr['posEnd'])
-        snp_count = snp_df[chr_match & pos_in_range].shape[0]
-        snp_counts.append(snp_count)
-    summary['Average number of SNPs per CNVR'] = np.mean(snp_counts)
-    
-    summary['Minimum size of CNVR (kb)'] = (df['posEnd'] - df['posStart']).min() / 1e3
-    summary['Maximum size of CNVR (kb)'] = (df['posEnd'] - df['posStart']).max() / 1e3
-    summary['Average CNVR size (kb)'] = (df['posEnd'] - df['posStart']).mean() / 1e3
-    summary['Standard deviation of CNVR size (kb)'] = (df['posEnd'] - df['posStart']).std() / 1e3
-    return summary
-
-def main(cnvr_file_path, snp_file_path, output_file_path):
-    # Read the CNVR data
-    cnvr_data = pd.read_csv(cnvr_file_path, delimiter="\t")
-
-    # Read the SNP data
-    snp_data = pd.read_csv(snp_file_path, delimiter="\t")
-
-    # Select SNPs from the first individual
-    first_individual = snp_data['Sample ID'].unique()[0]
-    individual_snp_data = snp_data[snp_data['Sample ID'] == first_individual]
-
-    # Calculate for total, gain, loss, and gain/loss
-    total_stats = calculate_summary_stats(cnvr_data, individual_snp_data)
-    gain_stats = calculate_summary_stats(cnvr_data[cnvr_data['Type'] == 'Gain'], individual_snp_data)
-    loss_stats = calculate_summary_stats(cnvr_data[cnvr_data['Type'] == 'Loss'], individual_snp_data)
-    gain_loss_stats = calculate_summary_stats(cnvr_data[cnvr_data['Type'] == 'Mixed'], individual_snp_data)
-
-    # Combine the results into a DataFrame
-    summary_df = pd.DataFrame([total_stats, gain_stats, loss_stats, gain_loss_stats], index=['Total', 'Gain', 'Loss', 'Mixed'])
-
-    # Transpose the DataFrame
-    transposed_summary_df = summary_df.transpose()
-
-    # Save the transposed summary statistics to a CSV file
-    transposed_summary_df.to_csv(output_file_path)
-
-    print("Transposed summary statistics table generated and saved successfully.")
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Calculate summary statistics for CNVR and SNP data.')
-    parser.add_argument('cnvr_file_path', type=str, help='Path to the CNVR file')
-    parser.add_argument('snp_file_path', type=str, help='Path to the SNP file')
-    parser.add_argument('output_file_path', type=str, help='Path to the output file')
-
-    args = parser.parse_args()
-
-    main(args.cnvr_file_path, args.snp_file_path, args.output_file_path)
\ No newline at end of file
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pandas as pd
+import numpy as np
+import argparse
+from genotype_schema import read_table, encode_chr
+
+# Default CNVR size bin edges (bp): < 10 kb, 10-50 kb, 50-100 kb, 100-500 kb, 500 kb-1 Mb, >= 1 Mb.
+# Bins are half-open [low, high), so a CNVR of exactly 50 kb is counted in 50-100 kb only
+DEFAULT_BIN_EDGES = [10e3, 50e3, 100e3, 500e3, 1e6]
+
+# Output columns of the default breakdown by Type; types without CNVRs are filled with zeros
+TYPE_COLUMNS = ['Total', 'Gain', 'Loss', 'Mixed']
+
+def size_label(bp):
+    if bp >= 1e6:
+        return f"{bp / 1e6:g} Mb"
+    return f"{bp / 1e3:g} kb"
+
+def bin_labels(bin_edges):
+    # Row labels of the size bins, e.g. 'Number of CNVR (10-50 kb)' or 'Number of CNVR (500 kb-1 Mb)'
+    labels = [f"< {size_label(bin_edges[0])}"]
+    for low, high in zip(bin_edges[:-1], bin_edges[1:]):
+        low, high = size_label(low), size_label(high)
+        low_value, low_unit = low.split(' ')
+        labels.append(f"{low_value}-{high}" if low_unit == high.split(' ')[1] else f"{low}-{high}")
+    labels.append(f">= {size_label(bin_edges[-1])}")
+    return [f"Number of CNVR ({label})" for label in labels]
+
+def count_snps(cnvr_df, snp_df):
+    # Number of SNPs inside each CNVR (both ends inclusive) by binary search of the sorted probe positions
+    chrom = encode_chr(cnvr_df['chr'])
+    starts = cnvr_df['posStart'].to_numpy(dtype=np.int64)
+    ends = cnvr_df['posEnd'].to_numpy(dtype=np.int64)
+    snp_counts = np.zeros(len(cnvr_df), dtype=np.int64)
+    for code, positions in snp_df.groupby('Chr')['Position']:
+        positions = np.sort(positions.to_numpy(dtype=np.int64))
+        rows = np.flatnonzero(chrom == code)
+        snp_counts[rows] = (np.searchsorted(positions, ends[rows], side='right')
+                            - np.searchsorted(positions, starts[rows], side='left'))
+    return snp_counts
+
+def calculate_summary_stats(cnvr_df, snp_counts, bin_edges=DEFAULT_BIN_EDGES, group_by=('Type',)):
+    # Summary statistics of all CNVRs ('Total') and of every group of the group_by columns, one column each
+    lengths = (cnvr_df['posEnd'] - cnvr_df['posStart']).to_numpy()
+    size_bins = np.searchsorted(bin_edges, lengths, side='right')
+    labels = bin_labels(bin_edges)
+
+    table = pd.DataFrame({'length': lengths, 'snps': snp_counts}, index=cnvr_df.index)
+    for i, label in enumerate(labels):
+        table[label] = size_bins == i
+
+    aggregations = {'Total length (Mb)': ('length', 'sum'),
+                    'Total number of CNVR': ('length', 'size'),
+                    **{label: (label, 'sum') for label in labels},
+                    'Average number of SNPs per CNVR': ('snps', 'mean'),
+                    'Minimum size of CNVR (kb)': ('length', 'min'),
+                    'Maximum size of CNVR (kb)': ('length', 'max'),
+                    'Average CNVR size (kb)': ('length', 'mean'),
+                    'Standard deviation of CNVR size (kb)': ('length', 'std')}
+
+    total = table.groupby(np.zeros(len(table), dtype=int)).agg(**aggregations)
+    total.index = ['Total']
+    summary = [total]
+    if group_by:
+        groups = table.groupby([cnvr_df[column] for column in group_by]).agg(**aggregations)
+        groups.index = ['_'.join(map(str, key)) if isinstance(key, tuple) else str(key) for key in groups.index]
+        summary.append(groups)
+    summary = pd.concat(summary).astype(float)
+    if list(group_by) == ['Type']:
+        summary = summary.reindex(TYPE_COLUMNS, fill_value=0)
+
+    summary['Total length (Mb)'] /= 1e6
+    for column in ['Minimum size of CNVR (kb)', 'Maximum size of CNVR (kb)', 'Average CNVR size (kb)',
+                   'Standard deviation of CNVR size (kb)']:
+        summary[column] /= 1e3
+    return summary
+
+def main(cnvr_file_path, snp_file_path, output_file_path, bin_edges=DEFAULT_BIN_EDGES, group_by=('Type',)):
+    # Read the CNVR data
+    cnvr_data = pd.read_csv(cnvr_file_path, delimiter="\t")
+
+    # Read the SNP data (only the columns needed) with compact column types; a probe list without
+    # 'Sample ID' (step7 --probes_only) is used as is
+    header = pd.read_csv(snp_file_path, sep='\t', nrows=0).columns
+    snp_data = read_table(snp_file_path, columns=[column for column in ['Sample ID', 'Chr', 'Position'] if column in header])
+
+    # Select SNPs from the first individual
+    if 'Sample ID' in snp_data.columns:
+        first_individual = snp_data['Sample ID'].iloc[0]
+        snp_data = snp_data[snp_data['Sample ID'] == first_individual]
+
+    # Count the SNPs of every CNVR once, then summarise all groups in a single grouped pass
+    snp_counts = count_snps(cnvr_data, snp_data)
+    summary_df = calculate_summary_stats(cnvr_data, snp_counts, bin_edges, group_by)
+
+    # Transpose the DataFrame
+    transposed_summary_df = summary_df.transpose()
+
+    # Save the transposed summary statistics to a CSV file
+    transposed_summary_df.to_csv(output_file_path)
+
+    print("Transposed summary statistics table generated and saved successfully.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Calculate summary statistics for CNVR and SNP data.')
+    parser.add_argument('cnvr_file_path', type=str, help='Path to the CNVR file')
+    parser.add_argument('snp_file_path', type=str, help='Path to the SNP file')
+    parser.add_argument('output_file_path', type=str, help='Path to the output file')
+    parser.add_argument('--bin_edges', type=float, nargs='+', default=DEFAULT_BIN_EDGES,
+                        help='CNVR size bin edges in bp (default: 10000 50000 100000 500000 1000000)')
+    parser.add_argument('--group_by', type=str, nargs='*', default=['Type'],
+                        help='CNVR columns to break the statistics down by, besides Total (default: Type)')
+
+    args = parser.parse_args()
+    if any(low >= high for low, high in zip(args.bin_edges[:-1], args.bin_edges[1:])):
+        parser.error("--bin_edges must be strictly increasing")
+
+    main(args.cnvr_file_path, args.snp_file_path, args.output_file_path, args.bin_edges, args.group_by)
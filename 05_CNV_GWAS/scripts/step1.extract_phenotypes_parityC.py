@@ -1,61 +1,67 @@
 #!/usr/bin/env python3
 
 import pandas as pd
+import numpy as np
+import argparse
 import sys
 
-def main():
-    if len(sys.argv) < 4 or len(sys.argv) > 5:
-        print("Usage: python script.py <phenotype_file> <output_file> <phenotype_column> [<sample_file>]")
-        sys.exit(1)
+def select_records(phenotype_df):
+    # One record per animal: its first record of parityC 2, otherwise of parityC 1, otherwise its first record.
+    # A rank key on parityC followed by a stable sort keeps file order within each rank.
+    rank = np.select([phenotype_df['parityC'] == 2, phenotype_df['parityC'] == 1], [0, 1], default=2)
+    ranked = phenotype_df.assign(_rank=rank).dropna(subset=['idanim'])
+    ranked = ranked.sort_values(['idanim', '_rank'], kind='stable')
+    return ranked.drop_duplicates(subset='idanim', keep='first').drop(columns='_rank').reset_index(drop=True)
 
-    phenotype_file = sys.argv[1]
-    output_file = sys.argv[2]
-    phenotype_column = sys.argv[3]
-    sample_file = sys.argv[4] if len(sys.argv) == 5 else None
+def format_phenotypes(records, phenotype_columns):
+    # 'sample id', 'fam' and 'sex' columns followed by the phenotype columns with two decimals
+    result_df = records[['idanim'] + phenotype_columns].rename(columns={'idanim': 'sample id'})
+    result_df.insert(1, 'fam', 'NA')
+    result_df.insert(2, 'sex', 'NA')
+    for column in phenotype_columns:
+        result_df[column] = result_df[column].map("{:.2f}".format)
+    return result_df
 
+def main(phenotype_file, output_file, phenotype_columns, sample_file=None, wide=False):
     # Read input files
-    phenotype_df = pd.read_csv(phenotype_file, delim_whitespace=True)
+    phenotype_df = pd.read_csv(phenotype_file, sep=r'\s+')
 
     if sample_file:
         sample_df = pd.read_csv(sample_file, header=None, names=['Sample_ID'])
         # Filter phenotype data to include only samples present in the sample file
-        filtered_df = phenotype_df[phenotype_df['idanim'].isin(sample_df['Sample_ID'])]
-    else:
-        filtered_df = phenotype_df
+        phenotype_df = phenotype_df[phenotype_df['idanim'].isin(sample_df['Sample_ID'])]
 
-    # Check if the phenotype column exists
-    if phenotype_column not in filtered_df.columns:
-        print(f"Phenotype column '{phenotype_column}' not found in phenotype file.")
+    # Check if the phenotype columns exist
+    missing = [column for column in phenotype_columns if column not in phenotype_df.columns]
+    if missing:
+        print(f"Phenotype column(s) {', '.join(missing)} not found in phenotype file.")
         sys.exit(1)
 
-    # Function to get the earliest record based on parityC
-    def get_earliest_record(group):
-        parity2_records = group[group['parityC'] == 2]
-        if not parity2_records.empty:
-            return parity2_records.iloc[0]
-        parity1_records = group[group['parityC'] == 1]
-        if not parity1_records.empty:
-            return parity1_records.iloc[0]
-        return group.iloc[0]
-
-    # Apply the function to each idanim group
-    result_df = filtered_df.groupby('idanim').apply(get_earliest_record).reset_index(drop=True)
-
-    # Select only the idanim and phenotype columns
-    result_df = result_df[['idanim', phenotype_column]]
+    # The record of each animal does not depend on the trait, so it is selected once for all of them
+    records = select_records(phenotype_df)
 
-    # Rename columns to match the output format
-    result_df.columns = ['sample id', phenotype_column]
+    # Save one wide table, or one file per trait, with header
+    if wide:
+        format_phenotypes(records, phenotype_columns).to_csv(output_file, sep='\t', index=False, header=True)
+        print(f"Phenotypes {', '.join(phenotype_columns)} saved to {output_file}")
+        return
+    for column in phenotype_columns:
+        trait_output_file = output_file.format(trait=column)
+        format_phenotypes(records, [column]).to_csv(trait_output_file, sep='\t', index=False, header=True)
+        print(f"Phenotype {column} saved to {trait_output_file}")
 
-    # Insert new columns 'fam' and 'sex' with values set to 'NA'
-    result_df.insert(1, 'fam', 'NA')
-    result_df.insert(2, 'sex', 'NA')
-
-    # Format the second column to two decimal places
-    result_df[phenotype_column] = result_df[phenotype_column].map("{:.2f}".format)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract one phenotype record per animal (parityC 2, then 1, then the first record).')
+    parser.add_argument('phenotype_file', type=str, help='Path to the whitespace-delimited phenotype file')
+    parser.add_argument('output_file', type=str, help="Path to the output file; with several traits and no --wide it must "
+                                                      "contain '{trait}', replaced by each trait name")
+    parser.add_argument('phenotype_column', type=str, help='Phenotype column, or several separated by commas')
+    parser.add_argument('sample_file', type=str, nargs='?', help='Optional file of sample IDs to keep')
+    parser.add_argument('--wide', action='store_true', help='Write all phenotype columns to one wide table')
 
-    # Save the result to the output file with header
-    result_df.to_csv(output_file, sep='\t', index=False, header=True)
+    args = parser.parse_args()
+    phenotype_columns = args.phenotype_column.split(',')
+    if len(phenotype_columns) > 1 and not args.wide and '{trait}' not in args.output_file:
+        parser.error("with several phenotype columns, output_file must contain '{trait}' unless --wide is given")
 
-if __name__ == "__main__":
-    main()
+    main(args.phenotype_file, args.output_file, phenotype_columns, args.sample_file, args.wide)
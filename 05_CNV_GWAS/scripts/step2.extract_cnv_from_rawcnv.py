@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import re
+import sys
+import argparse
+from penncnv_results import parse_rawcnv, parse_qc, add_cnv_counts, count_call_lines
+
+def main(input_file, output_file, sample_pattern='HR[0-9]+', log_file=None, qc_output=None):
+    # Parse every call line of the rawcnv file with one compiled expression
+    sample_pattern = re.compile(sample_pattern) if sample_pattern else None
+    with open(input_file, 'r') as file:
+        rawcnv = file.read()
+    cnv_df = parse_rawcnv(rawcnv, sample_pattern)
+
+    n_unparsed = count_call_lines(rawcnv) - len(cnv_df)
+    if n_unparsed:
+        print(f"WARNING: {n_unparsed} lines of {input_file} could not be parsed and were skipped", file=sys.stderr)
+
+    # Write the formatted CNV table
+    cnv_df.to_csv(output_file, sep='\t', index=False)
+    print(f"{len(cnv_df)} CNVs saved to {output_file}")
+
+    # Per-sample QC table from the quality summaries of the PennCNV log
+    if log_file and qc_output:
+        with open(log_file, 'r') as file:
+            qc_df = add_cnv_counts(parse_qc(file.read(), sample_pattern), cnv_df)
+        qc_df.to_csv(qc_output, sep='\t', index=False)
+        print(f"QC summary of {len(qc_df)} samples saved to {qc_output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert a PennCNV rawcnv file into a tab-delimited CNV table.')
+    parser.add_argument('input_file', type=str, help='Path to the rawcnv file')
+    parser.add_argument('output_file', type=str, help='Path to the output file')
+    parser.add_argument('--sample_pattern', type=str, default='HR[0-9]+',
+                        help="Regular expression picking the sample ID out of the signal file path "
+                             "(default: 'HR[0-9]+'; an empty string uses the file name)")
+    parser.add_argument('--log', type=str, help='PennCNV log file to take the per-sample quality summaries from')
+    parser.add_argument('--qc_output', type=str, help='Path to save the per-sample QC table (with --log)')
+
+    args = parser.parse_args()
+    if bool(args.log) != bool(args.qc_output):
+        parser.error("--log and --qc_output must be given together")
+
+    main(args.input_file, args.output_file, args.sample_pattern, args.log, args.qc_output)
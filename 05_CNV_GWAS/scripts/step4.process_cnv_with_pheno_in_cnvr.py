@@ -2,35 +2,30 @@
 
 import pandas as pd
 import sys
+from genotype_schema import encode_chr, chr_labels
+from interval_index import build_index, contain_pairs, first_match
 
 def filter_cnv_in_cnvr(cnv_file, cnvr_file, output_file):
     # Read the input files
     cnv_df = pd.read_csv(cnv_file, sep="\t")
     cnvr_df = pd.read_csv(cnvr_file, sep="\t")
 
-    # Add a column to store the filter results
-    cnv_df['in_cnvr'] = False
-
-    # Iterate over each row in the CNVR file
-    for index, row in cnvr_df.iterrows():
-        chr_cnvr = row['chr']
-        posStart_cnvr = row['posStart']
-        posEnd_cnvr = row['posEnd']
-        
-        # Update the in_cnvr column for CNVs that match the current CNVR range
-        cnv_df.loc[
-            (cnv_df['chr'] == f'chr{chr_cnvr}') &
-            (cnv_df['start'] >= posStart_cnvr) &
-            (cnv_df['end'] <= posEnd_cnvr),
-            'in_cnvr'
-        ] = True
-
-    # Filter the CNV dataframe to keep only rows that are within any CNVR
-    filtered_cnv_df = cnv_df[cnv_df['in_cnvr']].copy()
-    filtered_cnv_df.drop(columns=['in_cnvr'], inplace=True)
-
-    # Remove the 'chr' prefix in the 'chr' column for the filtered DataFrame
-    filtered_cnv_df['chr'] = filtered_cnv_df['chr'].str.replace('chr', '')
+    # Normalize chromosome labels ('chr1' in the CNV calls, 1 in the CNVRs) to integer codes once
+    cnv_chr = encode_chr(cnv_df['chr'])
+    cnvr_chr = encode_chr(cnvr_df['chr'])
+
+    # Assign every CNV to the first CNVR (in file order) containing it, in one indexed join;
+    # CNVs on unrecognised chromosomes are never matched
+    cnvr_index = build_index(cnvr_chr, cnvr_df['posStart'], cnvr_df['posEnd'])
+    cnvr_index.pop(-1, None)
+    match = first_match(contain_pairs(cnvr_index, cnv_chr, cnv_df['start'], cnv_df['end']), len(cnv_df))
+
+    # Filter the CNV dataframe to keep only rows that are within any CNVR, with the chromosome
+    # written without the 'chr' prefix and the matched CNVR_ID
+    in_cnvr = match >= 0
+    filtered_cnv_df = cnv_df[in_cnvr].copy()
+    filtered_cnv_df['chr'] = chr_labels(cnv_chr[in_cnvr])
+    filtered_cnv_df['CNVR_ID'] = cnvr_df['CNVR_ID'].to_numpy()[match[in_cnvr]]
 
     # Save the filtered results to a new file
     filtered_cnv_df.to_csv(output_file, sep="\t", index=False)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# CNVR association test of every trait against the encoded sample x CNVR matrix
+# written by 04/06 step5.encode_cnvr.py (-1 loss, 0 normal, 1 gain dosages).
+#
+# For every CNVR x trait pair the model is  trait ~ intercept + covariates + dosage,
+# fitted by ordinary least squares. The intercept and covariates are projected out
+# of the traits and of the dosages once, after which all slopes, standard errors
+# and t statistics of a block of CNVRs are a few matrix products for all traits
+# together. Traits with the same missing samples share one projection.
+
+import pandas as pd
+import numpy as np
+import argparse
+from scipy import stats
+from statsmodels.stats.multitest import multipletests
+from cnvr_matrix import load_encoded_matrix
+
+# Number of CNVR columns made dense at a time
+DEFAULT_BLOCK_SIZE = 4096
+
+def read_phenotypes(phenotype_path, traits=None):
+    # Phenotype table as written by step1 (one trait or --wide): 'sample id', 'fam', 'sex', then trait columns
+    phenotypes = pd.read_csv(phenotype_path, sep='\t', dtype={'sample id': str}).set_index('sample id')
+    traits = traits or [column for column in phenotypes.columns if column not in ('fam', 'sex')]
+    return phenotypes[traits].apply(pd.to_numeric, errors='coerce')
+
+def read_covariates(covariate_path):
+    # 'sample id' plus covariate columns; text columns become indicator columns
+    covariates = pd.read_csv(covariate_path, sep='\t', dtype={'sample id': str}).set_index('sample id')
+    return pd.get_dummies(covariates, drop_first=True, dtype=float)
+
+def covariate_basis(covariates):
+    # Orthonormal basis of the intercept and covariate columns (collinear columns dropped)
+    design = np.column_stack([np.ones(len(covariates)), covariates])
+    basis, singular_values, _ = np.linalg.svd(design, full_matrices=False)
+    return basis[:, singular_values > singular_values[0] * len(design) * np.finfo(float).eps]
+
+def residualize(basis, values):
+    return values - basis @ (basis.T @ values)
+
+def test_block(dosage, basis, traits_resid, traits_ss, df):
+    # OLS slope, standard error, t statistic and p-value of every CNVR (rows) x trait (columns)
+    dosage_resid = residualize(basis, dosage)
+    sxx = (dosage_resid ** 2).sum(axis=0)[:, None]
+    sxy = dosage_resid.T @ traits_resid
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = sxy / sxx
+        rss = traits_ss[None, :] - beta * sxy
+        se = np.sqrt(np.maximum(rss, 0) / df / sxx)
+        t = beta / se
+    # CNVRs without variation among the tested samples have no estimate
+    no_variation = sxx[:, 0] <= 1e-12
+    beta[no_variation], se[no_variation], t[no_variation] = np.nan, np.nan, np.nan
+    return beta, se, t, 2 * stats.t.sf(np.abs(t), df)
+
+def run_association(matrix, sample_ids, phenotypes, covariates=None, block_size=DEFAULT_BLOCK_SIZE):
+    # Results per trait as a dict of arrays over the matrix CNVR columns
+    samples = pd.Index(sample_ids).intersection(phenotypes.index, sort=False)
+    if covariates is not None:
+        samples = samples.intersection(covariates.index[covariates.notna().all(axis=1)], sort=False)
+    matrix_rows = pd.Index(sample_ids).get_indexer(samples)
+    trait_values = phenotypes.loc[samples]
+    covariate_values = covariates.loc[samples].to_numpy(dtype=float) if covariates is not None else np.empty((len(samples), 0))
+
+    # Traits observed on the same samples are tested together
+    observed = trait_values.notna().to_numpy()
+    patterns = {}
+    for i, trait in enumerate(trait_values.columns):
+        patterns.setdefault(observed[:, i].tobytes(), []).append(trait)
+
+    results = {}
+    for pattern, traits in patterns.items():
+        keep = np.frombuffer(pattern, dtype=bool)
+        basis = covariate_basis(covariate_values[keep])
+        df = keep.sum() - basis.shape[1] - 1
+        traits_resid = residualize(basis, trait_values.loc[keep, traits].to_numpy(dtype=float))
+        traits_ss = (traits_resid ** 2).sum(axis=0)
+        dosages = matrix[matrix_rows[keep]].tocsc()
+
+        blocks = [test_block(dosages[:, start:start + block_size].toarray().astype(float), basis, traits_resid, traits_ss, df)
+                  for start in range(0, dosages.shape[1], block_size)]
+        beta, se, t, p = (np.vstack([block[i] for block in blocks]) for i in range(4))
+        for j, trait in enumerate(traits):
+            results[trait] = {'N': int(keep.sum()), 'Beta': beta[:, j], 'SE': se[:, j], 'T': t[:, j], 'Pvalue': p[:, j]}
+    return results
+
+def bh_adjust(pvalues):
+    # Benjamini-Hochberg adjusted p-values; missing p-values stay missing
+    adjusted = np.full(len(pvalues), np.nan)
+    tested = ~np.isnan(pvalues)
+    if tested.any():
+        adjusted[tested] = multipletests(pvalues[tested], method='fdr_bh')[1]
+    return adjusted
+
+def main(encoded_matrix_prefix, phenotype_path, cnvr_path, output_path, traits=None, covariate_path=None,
+         block_size=DEFAULT_BLOCK_SIZE):
+    # Load the encoded matrix and the CNVR coordinates once
+    matrix, sample_ids, cnvr_ids = load_encoded_matrix(encoded_matrix_prefix)
+    cnvr_df = pd.read_csv(cnvr_path, sep='\t').drop_duplicates(subset='CNVR_ID').set_index('CNVR_ID').loc[cnvr_ids]
+
+    phenotypes = read_phenotypes(phenotype_path, traits)
+    covariates = read_covariates(covariate_path) if covariate_path else None
+
+    results = run_association(matrix, sample_ids, phenotypes, covariates, block_size)
+
+    # One row per CNVR and trait; coordinates, Phenotype and MinPvalueAdjusted use the column names of the
+    # CNVRanger segs_pvalue output, so that 06 step1.extract_cnvr_after_gwas.py reads this table directly
+    output = pd.concat([pd.DataFrame({'CNVR_ID': cnvr_ids,
+                                      'seqnames': cnvr_df['chr'].to_numpy(),
+                                      'start': cnvr_df['posStart'].to_numpy(),
+                                      'end': cnvr_df['posEnd'].to_numpy(),
+                                      'Phenotype': trait,
+                                      **result,
+                                      'MinPvalueAdjusted': bh_adjust(result['Pvalue'])})
+                        for trait, result in ((trait, results[trait]) for trait in phenotypes.columns)],
+                       ignore_index=True)
+    output.to_csv(output_path, sep='\t', index=False)
+
+    print(f"{len(cnvr_ids)} CNVRs tested against {len(phenotypes.columns)} trait(s); results saved to {output_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Test every CNVR of the encoded matrix against every trait by least squares.')
+    parser.add_argument('encoded_matrix_prefix', type=str, help='Prefix of the encoded CNVR matrix written by step5.encode_cnvr.py')
+    parser.add_argument('phenotype_path', type=str, help="Phenotype table ('sample id', 'fam', 'sex' and trait columns)")
+    parser.add_argument('cnvr_path', type=str, help='Path to the final CNVR types file')
+    parser.add_argument('output_path', type=str, help='Path to save the association results')
+    parser.add_argument('--traits', type=str, nargs='+', help='Trait columns to test (default: all)')
+    parser.add_argument('--covariates', type=str, help="Covariate table with a 'sample id' column")
+    parser.add_argument('--block_size', type=int, default=DEFAULT_BLOCK_SIZE, help='CNVRs tested per block')
+
+    args = parser.parse_args()
+
+    main(args.encoded_matrix_prefix, args.phenotype_path, args.cnvr_path, args.output_path, args.traits, args.covariates,
+         args.block_size)
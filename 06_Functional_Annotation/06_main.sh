@@ -43,6 +43,9 @@ if (!require('GALLO', character.only = TRUE, quietly = TRUE)) {
 PY_LIB_PATH="/exports/cmvm/eddie/eb/groups/PocrnicLab/2024_ms_cnv/02_Tools_and_Computational_Environment/py_libs/"
 export PYTHONPATH="${PY_LIB_PATH}:$PYTHONPATH"
 
+# Shared Python modules used by the pipeline scripts
+export PYTHONPATH="${PIPELINE}/00_Common/scripts:$PYTHONPATH"
+
 # Required packages
 REQUIRED_PKG=("pandas" "matplotlib" "seaborn" "scipy" "numpy" "statsmodels")
 
@@ -2,59 +2,55 @@
 
 import pandas as pd
 import argparse
-import sys
-
-def main(segs_pvalue_path, cnvr_final_path, output_path, pvalue_threshold):
-    try:
-        # Read input files
-        segs_pvalue_df = pd.read_csv(segs_pvalue_path, sep='\t')
-        cnvr_final_df = pd.read_csv(cnvr_final_path, sep='\t')
-
-        # Filter segs_pvalue where MinPvalueAdjusted < threshold
-        filtered_segs_pvalue_df = segs_pvalue_df[segs_pvalue_df['MinPvalueAdjusted'] < pvalue_threshold]
-
-        # Initialize result list
-        results = []
-
-        # Match filtered data with cnvr_final data
-        for _, seg_row in filtered_segs_pvalue_df.iterrows():
-            chr = seg_row['seqnames']
-            start = seg_row['start']
-            end = seg_row['end']
-            phenotype = seg_row['Phenotype']
-
-            matched_cnvr_rows = cnvr_final_df[
-                (cnvr_final_df['chr'] == chr) & 
-                (cnvr_final_df['posStart'] <= start) & 
-                (cnvr_final_df['posEnd'] >= end)
-            ]
-
-            for _, cnvr_row in matched_cnvr_rows.iterrows():
-                result = {
-                    'CNVR_ID': cnvr_row['CNVR_ID'],
-                    'First.marker.in.the.window': cnvr_row['start_snp'],
-                    'Last.marker.in.the.window': cnvr_row['end_snp'],
-                    'Trait': phenotype,
-                    'CHR': cnvr_row['chr'],
-                    'BP1': cnvr_row['posStart'],
-                    'BP2': cnvr_row['posEnd']
-                }
-                results.append(result)
-
-        # Convert results to DataFrame and output, keeping unique CNVR_IDs
-        result_df = pd.DataFrame(results).drop_duplicates(subset=['CNVR_ID'])
-        result_df.to_csv(output_path, sep='\t', index=False)
-        print(f"Results saved to {output_path}")
-
-    except Exception as e:
-        print(f"An error occurred: {e}", file=sys.stderr)
+from interval_index import build_index, contain_pairs
+
+def extract_cnvrs(segs_pvalue_df, cnvr_final_df, pvalue_thresholds):
+    # CNVRs containing a segment with MinPvalueAdjusted below each threshold. The segments are joined once,
+    # at the loosest threshold, and each threshold then keeps its own subset of the matched pairs.
+    filtered_segs_pvalue_df = segs_pvalue_df[segs_pvalue_df['MinPvalueAdjusted'] < max(pvalue_thresholds)]
+
+    # Match filtered data with cnvr_final data: the CNVRs containing each segment, in one indexed join
+    cnvr_index = build_index(cnvr_final_df['chr'], cnvr_final_df['posStart'], cnvr_final_df['posEnd'])
+    seg_rows, cnvr_rows = contain_pairs(cnvr_index, filtered_segs_pvalue_df['seqnames'],
+                                        filtered_segs_pvalue_df['start'], filtered_segs_pvalue_df['end'])
+    matched_cnvr_rows = cnvr_final_df.iloc[cnvr_rows]
+    results = pd.DataFrame({
+        'CNVR_ID': matched_cnvr_rows['CNVR_ID'].to_numpy(),
+        'First.marker.in.the.window': matched_cnvr_rows['start_snp'].to_numpy(),
+        'Last.marker.in.the.window': matched_cnvr_rows['end_snp'].to_numpy(),
+        'Trait': filtered_segs_pvalue_df['Phenotype'].to_numpy()[seg_rows],
+        'CHR': matched_cnvr_rows['chr'].to_numpy(),
+        'BP1': matched_cnvr_rows['posStart'].to_numpy(),
+        'BP2': matched_cnvr_rows['posEnd'].to_numpy()
+    })
+    pvalues = filtered_segs_pvalue_df['MinPvalueAdjusted'].to_numpy()[seg_rows]
+
+    return pd.concat([results[pvalues < threshold].assign(Threshold=threshold) for threshold in pvalue_thresholds],
+                     ignore_index=True)
+
+def main(segs_pvalue_paths, cnvr_final_path, output_path, pvalue_thresholds):
+    # Read input files: cnvr_final once, and the segments of every trait
+    segs_pvalue_df = pd.concat([pd.read_csv(path, sep='\t') for path in segs_pvalue_paths], ignore_index=True)
+    cnvr_final_df = pd.read_csv(cnvr_final_path, sep='\t')
+
+    results = extract_cnvrs(segs_pvalue_df, cnvr_final_df, pvalue_thresholds)
+
+    # Output, keeping unique CNVR_IDs. A single file at a single threshold keeps the one-trait layout;
+    # otherwise one long table with a row per trait, threshold and CNVR
+    if len(segs_pvalue_paths) == 1 and len(pvalue_thresholds) == 1:
+        result_df = results.drop(columns='Threshold').drop_duplicates(subset=['CNVR_ID'])
+    else:
+        result_df = results.drop_duplicates(subset=['Trait', 'Threshold', 'CNVR_ID'])
+    result_df.to_csv(output_path, sep='\t', index=False)
+    print(f"Results saved to {output_path}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process segs_pvalue and cnvr_final files.')
-    parser.add_argument('segs_pvalue_path', type=str, help='Path to the segs_pvalue file')
+    parser.add_argument('segs_pvalue_paths', type=str, nargs='+', help='Path to the segs_pvalue file(s), one per trait')
     parser.add_argument('cnvr_final_path', type=str, help='Path to the cnvr_final file')
     parser.add_argument('output_path', type=str, help='Path to save the output file')
-    parser.add_argument('--pvalue_threshold', type=float, default=0.05, help='Threshold for MinPvalueAdjusted')
+    parser.add_argument('--pvalue_threshold', type=float, nargs='+', default=[0.05],
+                        help='Threshold(s) for MinPvalueAdjusted')
 
     args = parser.parse_args()
-    main(args.segs_pvalue_path, args.cnvr_final_path, args.output_path, args.pvalue_threshold)
+    main(args.segs_pvalue_paths, args.cnvr_final_path, args.output_path, args.pvalue_threshold)
@@ -44,6 +44,9 @@ if (!require('GALLO', character.only = TRUE, quietly = TRUE)) {
 PY_LIB_PATH="/exports/cmvm/eddie/eb/groups/PocrnicLab/2024_ms_cnv/02_Tools_and_Computational_Environment/py_libs/"
 export PYTHONPATH="${PY_LIB_PATH}:$PYTHONPATH"
 
+# Shared Python modules used by the pipeline scripts
+export PYTHONPATH="${PIPELINE}/00_Common/scripts:$PYTHONPATH"
+
 # Required packages
 REQUIRED_PKG=("pandas" "matplotlib" "seaborn" "scipy" "numpy" "statsmodels")
 
@@ -69,15 +72,6 @@ run_snp_gwas() {
 
   cd ${PIPELINE}/07_SNP_GWAS/results/${trait}
 
-  cp ${PIPELINE}/02_Quality_Control_by_Plink/results/plink_results/filtered_data_final.* \
-    ${PIPELINE}/07_SNP_GWAS/results/${trait}
-
-  python ${PIPELINE}/07_SNP_GWAS/scripts/step1.update_fam_with_phenotype.py \
-    ${PIPELINE}/07_SNP_GWAS/results/${trait}/filtered_data_final.fam \
-    ${PIPELINE}/05_CNV_GWAS/results/${trait}/phenotypes.txt
-
-  bash ${PIPELINE}/07_SNP_GWAS/scripts/step2.snp_gwas.sh
-  
   Rscript ${PIPELINE}/07_SNP_GWAS/scripts/step2a.plot_manhattan.R \
   ${PIPELINE}/07_SNP_GWAS/results/${trait}/assoc_results.assoc.linear \
   ${PIPELINE}/07_SNP_GWAS/results/${trait}/assoc_results.assoc.linear.adjusted \
@@ -126,6 +120,13 @@ filter_snps_and_run_gallo() {
   ${PIPELINE}/07_SNP_GWAS/results/${trait}/go_kegg_info.csv
 }
 
+## Run SNP-GWAS of all traits in one pass on the QC'd PLINK files =============================================================
+python ${PIPELINE}/07_SNP_GWAS/scripts/step2.snp_gwas.py \
+  ${PIPELINE}/02_Quality_Control_by_Plink/results/plink_results/filtered_data_final \
+  ${PIPELINE}/05_CNV_GWAS/results/phenotypes_all_traits.txt \
+  ${PIPELINE}/07_SNP_GWAS/results/{trait}/assoc_results \
+  --traits milk fat prot
+
 ## Run SNP-GWAS and subsequent steps for each trait =============================================================
 for trait in milk fat prot; do
   run_snp_gwas $trait
@@ -1,43 +1,85 @@
 #!/usr/bin/env python3
 
+import os
+import tempfile
 import pandas as pd
 import argparse
 
-def update_fam_file(fam_file_path, phenotype_file_path):
-    # Read the .fam file
-    fam_df = pd.read_csv(fam_file_path, sep=" ", header=None)
-    fam_df.columns = ["FID", "IID", "PID", "MID", "Sex", "Pheno"]
+def write_atomic(df, path, **kwargs):
+    # Write to a temporary file next to path and rename it over path, so that readers
+    # (e.g. concurrent plink runs) never see a partly written file
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(handle, 'w') as file:
+            df.to_csv(file, **kwargs)
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_path, 0o666 & ~umask)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
 
-    # Read the phenotype file
+def read_phenotypes(phenotype_file_path, traits=None):
+    # Phenotype table from 05 step1: sample ID, fam, sex, then one column per trait
     phenotype_df = pd.read_csv(phenotype_file_path, sep="\t")
-    phenotype_df.columns = ["SampleID", "Fam", "Sex", "Phenotype"]
+    phenotype_df = phenotype_df.rename(columns={phenotype_df.columns[0]: "SampleID"}).drop_duplicates(subset="SampleID")
+    traits = traits or list(phenotype_df.columns[3:])
+    return phenotype_df.set_index("SampleID")[traits]
 
-    # Create a dictionary for phenotypes
-    phenotype_dict = dict(zip(phenotype_df["SampleID"], phenotype_df["Phenotype"]))
+def phenotype_column(fam_df, phenotypes, trait):
+    # Phenotype of every .fam sample as text: the trait value for samples in the phenotype file,
+    # the existing .fam value for the others, and -9 where missing
+    known = fam_df["IID"].isin(phenotypes.index)
+    pheno = fam_df["Pheno"].astype(object)
+    pheno[known] = fam_df.loc[known, "IID"].map(phenotypes[trait]).astype(object)
+    return pheno.where(pheno.notna(), -9).astype(str).replace("-9.0", "-9")
 
-    # Update the phenotype column in the .fam file only for matching samples
-    fam_df["Pheno"] = fam_df.apply(
-        lambda row: phenotype_dict[row["IID"]] if row["IID"] in phenotype_dict else row["Pheno"], axis=1
-    )
+def update_fam_file(fam_file_path, phenotype_file_path, traits=None, pheno_output=None, fam_output=None):
+    # Read the .fam file
+    fam_df = pd.read_csv(fam_file_path, sep=" ", header=None)
+    fam_df.columns = ["FID", "IID", "PID", "MID", "Sex", "Pheno"]
 
-    # Ensure that missing phenotypes remain as -9 (integer)
-    fam_df["Pheno"] = fam_df["Pheno"].apply(lambda x: -9 if pd.isnull(x) else x)
+    phenotypes = read_phenotypes(phenotype_file_path, traits)
 
-    # Convert all values to string and specifically ensure -9 is an integer
-    fam_df["Pheno"] = fam_df["Pheno"].astype(str).replace("-9.0", "-9")
+    # One PLINK --pheno file with a column per trait (use with --pheno-name or --all-pheno)
+    if pheno_output:
+        pheno_df = fam_df[["FID", "IID"]].copy()
+        for trait in phenotypes.columns:
+            pheno_df[trait] = phenotype_column(fam_df.assign(Pheno=-9), phenotypes, trait)
+        write_atomic(pheno_df, pheno_output, sep=" ", index=False)
+        print(f"Phenotypes {', '.join(phenotypes.columns)} saved to {pheno_output}")
 
-    # Save the updated .fam file
-    fam_df.to_csv(fam_file_path, sep=" ", header=False, index=False, float_format='%.0f')
+    # A .fam copy per trait, all sharing the same .bed/.bim (use with --bed/--bim/--fam in manual plink runs)
+    if fam_output:
+        for trait in phenotypes.columns:
+            trait_fam_path = fam_output.format(trait=trait)
+            write_atomic(fam_df.assign(Pheno=phenotype_column(fam_df, phenotypes, trait)), trait_fam_path,
+                         sep=" ", header=False, index=False, float_format='%.0f')
+            print(f"Phenotype {trait} saved to {trait_fam_path}")
 
-    print("Phenotype update completed!")
+    # Otherwise update the phenotype column of the .fam file itself
+    if not pheno_output and not fam_output:
+        if len(phenotypes.columns) != 1:
+            raise ValueError("Updating the .fam file in place needs a single trait; use --traits, --pheno_output or --fam_output")
+        fam_df["Pheno"] = phenotype_column(fam_df, phenotypes, phenotypes.columns[0])
+        write_atomic(fam_df, fam_file_path, sep=" ", header=False, index=False, float_format='%.0f')
+        print("Phenotype update completed!")
 
 def main():
     parser = argparse.ArgumentParser(description="Update phenotype in .fam file based on a phenotype file.")
     parser.add_argument("fam_file_path", type=str, help="Path to the .fam file")
-    parser.add_argument("phenotype_file_path", type=str, help="Path to the phenotype file")
+    parser.add_argument("phenotype_file_path", type=str, help="Path to the phenotype file (one trait or a --wide table)")
+    parser.add_argument("--traits", type=str, nargs="+", help="Trait columns to use (default: all)")
+    parser.add_argument("--pheno_output", type=str, help="Write a PLINK --pheno file with one column per trait instead")
+    parser.add_argument("--fam_output", type=str, help="Write a .fam copy per trait instead; '{trait}' is replaced by the trait name")
     args = parser.parse_args()
+    if args.fam_output and (args.traits is None or len(args.traits) > 1) and '{trait}' not in args.fam_output:
+        parser.error("--fam_output must contain '{trait}' unless a single trait is given with --traits")
 
-    update_fam_file(args.fam_file_path, args.phenotype_file_path)
+    update_fam_file(args.fam_file_path, args.phenotype_file_path, args.traits, args.pheno_output, args.fam_output)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Linear SNP association of several phenotypes at once on a PLINK binary fileset.
+# Python counterpart of step2.snp_gwas.sh (plink --linear --adjust) for many traits:
+# the .bed file is memory-mapped, blocks of SNPs are decoded into A1 allele dosages
+# and every SNP x trait regression is computed from a few blocked matrix products.
+#
+# Missing genotypes and phenotypes are left out pair by pair, as plink does: the sums
+# entering each regression only run over the samples observed for both the SNP and
+# the trait. Results are written per trait in the assoc.linear and
+# assoc.linear.adjusted layouts read by step2a/step3. step2.snp_gwas.sh is kept as the
+# plink fallback, run on a .fam written by step1.update_fam_with_phenotype.py.
+
+import os
+import numpy as np
+import pandas as pd
+import argparse
+from scipy import stats
+from statsmodels.stats.multitest import multipletests
+
+BED_MAGIC = bytes([0x6c, 0x1b, 0x01])
+
+# Number of SNPs decoded per block
+DEFAULT_BLOCK_SIZE = 8192
+
+# A1 allele count of each 2-bit .bed code: 00 hom A1, 01 missing, 10 het, 11 hom A2
+CODE_DOSAGE = np.array([2.0, np.nan, 1.0, 0.0], dtype=np.float32)
+
+# Dosages of the four samples packed in every possible byte (low-order bits first)
+BYTE_DOSAGES = CODE_DOSAGE[(np.arange(256)[:, None] >> np.array([0, 2, 4, 6])) & 3]
+
+def read_bim(bfile):
+    return pd.read_csv(f"{bfile}.bim", sep=r'\s+', header=None, names=['CHR', 'SNP', 'CM', 'BP', 'A1', 'A2'],
+                       dtype={'CHR': str, 'SNP': str, 'A1': str, 'A2': str})
+
+def read_fam(bfile):
+    return pd.read_csv(f"{bfile}.fam", sep=r'\s+', header=None, names=['FID', 'IID', 'PID', 'MID', 'Sex', 'Pheno'],
+                       dtype={'FID': str, 'IID': str})
+
+def open_bed(bfile, n_samples, n_snps):
+    # SNP-major .bed file as an (n_snps, bytes per SNP) uint8 memory map
+    path = f"{bfile}.bed"
+    with open(path, 'rb') as file:
+        if file.read(3) != BED_MAGIC:
+            raise ValueError(f"{path} is not a SNP-major PLINK .bed file")
+    bytes_per_snp = (n_samples + 3) // 4
+    return np.memmap(path, dtype=np.uint8, mode='r', offset=3, shape=(n_snps, bytes_per_snp))
+
+def decode_block(bed, start, stop, n_samples):
+    # Sample x SNP float32 dosages of SNPs start..stop, NaN for missing genotypes
+    return BYTE_DOSAGES[bed[start:stop]].reshape(stop - start, -1)[:, :n_samples].T
+
+def read_phenotypes(phenotype_path, sample_ids, traits=None):
+    # Sample x trait phenotypes aligned to the .fam order from a step1 table ('sample id', 'fam', 'sex', traits);
+    # samples without a record and -9 values are missing
+    phenotypes = pd.read_csv(phenotype_path, sep='\t', dtype={'sample id': str}).drop_duplicates(subset='sample id')
+    traits = traits or [column for column in phenotypes.columns if column not in ('sample id', 'fam', 'sex')]
+    values = phenotypes.set_index('sample id')[traits].apply(pd.to_numeric, errors='coerce').reindex(sample_ids)
+    return values.mask(values == -9)
+
+def test_block(dosages, traits, traits_observed):
+    # Per SNP x trait sums over the samples observed for both, then the simple regression on them
+    genotyped = ~np.isnan(dosages)
+    x = np.where(genotyped, dosages, 0).astype(np.float64)
+    g = genotyped.astype(np.float64)
+
+    n = g.T @ traits_observed
+    sx, sxx = x.T @ traits_observed, (x ** 2).T @ traits_observed
+    sy, syy = g.T @ traits, g.T @ traits ** 2
+    sxy = x.T @ traits
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vx = sxx - sx ** 2 / n
+        cov = sxy - sx * sy / n
+        beta = cov / vx
+        rss = syy - sy ** 2 / n - beta * cov
+        df = n - 2
+        t = beta / np.sqrt(np.maximum(rss, 0) / df / vx)
+    # Monomorphic SNPs and pairs with fewer than three samples have no estimate
+    undefined = (vx <= 1e-12) | (df < 1)
+    beta[undefined], t[undefined] = np.nan, np.nan
+    p = 2 * stats.t.sf(np.abs(t), np.maximum(df, 1))
+    return n.astype(np.int64), beta, t, p
+
+def adjust_pvalues(pvalues):
+    # Columns of plink --adjust for the SNPs with a p-value
+    if len(pvalues) == 0:
+        return {column: pvalues for column in ('UNADJ', 'GC', 'BONF', 'HOLM', 'SIDAK_SS', 'SIDAK_SD', 'FDR_BH', 'FDR_BY')}, np.nan
+    chisq = stats.chi2.isf(pvalues, 1)
+    gc_lambda = max(np.median(chisq) / stats.chi2.ppf(0.5, 1), 1.0)
+    adjusted = {'UNADJ': pvalues,
+                'GC': stats.chi2.sf(chisq / gc_lambda, 1),
+                'BONF': np.minimum(pvalues * len(pvalues), 1.0)}
+    for column, method in (('HOLM', 'holm'), ('SIDAK_SS', 'sidak'), ('SIDAK_SD', 'holm-sidak'),
+                           ('FDR_BH', 'fdr_bh'), ('FDR_BY', 'fdr_by')):
+        adjusted[column] = multipletests(pvalues, method=method)[1]
+    return adjusted, gc_lambda
+
+def format_column(values, pattern='{:.4g}'):
+    return ['NA' if pd.isna(value) else pattern.format(value) for value in values]
+
+def write_table(df, path):
+    # Whitespace-aligned table as written by plink
+    widths = {column: max(len(column), df[column].str.len().max() if len(df) else 0) for column in df.columns}
+    with open(path, 'w') as file:
+        file.write(' '.join(column.rjust(widths[column]) for column in df.columns) + '\n')
+        if not len(df):
+            return
+        rows = zip(*(df[column].str.rjust(widths[column]) for column in df.columns))
+        file.writelines(' '.join(row) + '\n' for row in rows)
+
+def write_trait_results(bim, n, beta, t, p, out_prefix):
+    linear = pd.DataFrame({'CHR': bim['CHR'], 'SNP': bim['SNP'], 'BP': bim['BP'].astype(str), 'A1': bim['A1'],
+                           'TEST': 'ADD', 'NMISS': n.astype(str), 'BETA': format_column(beta),
+                           'STAT': format_column(t), 'P': format_column(p)})
+    write_table(linear, f"{out_prefix}.assoc.linear")
+
+    # Adjusted p-values of the tested SNPs, most significant first
+    tested = np.flatnonzero(~np.isnan(p))
+    order = tested[np.argsort(p[tested], kind='stable')]
+    adjusted, gc_lambda = adjust_pvalues(p[order])
+    adjusted_df = pd.DataFrame({'CHR': bim['CHR'].to_numpy()[order], 'SNP': bim['SNP'].to_numpy()[order],
+                                **{column: format_column(values) for column, values in adjusted.items()}})
+    write_table(adjusted_df, f"{out_prefix}.assoc.linear.adjusted")
+    return gc_lambda
+
+def main(bfile, phenotype_path, out_prefix, traits=None, block_size=DEFAULT_BLOCK_SIZE):
+    bim, fam = read_bim(bfile), read_fam(bfile)
+    bed = open_bed(bfile, len(fam), len(bim))
+    phenotypes = read_phenotypes(phenotype_path, fam['IID'], traits)
+
+    # Phenotypes are centred (slopes do not change) so that the sums of squares keep their precision
+    traits_observed = phenotypes.notna().to_numpy(dtype=np.float64)
+    trait_values = (phenotypes - phenotypes.mean()).fillna(0).to_numpy(dtype=np.float64)
+
+    # All traits are tested on each decoded SNP block
+    blocks = [test_block(decode_block(bed, start, min(start + block_size, len(bim)), len(fam)), trait_values, traits_observed)
+              for start in range(0, len(bim), block_size)]
+    n, beta, t, p = (np.vstack([block[i] for block in blocks]) for i in range(4))
+
+    for j, trait in enumerate(phenotypes.columns):
+        trait_prefix = out_prefix.format(trait=trait)
+        os.makedirs(os.path.dirname(trait_prefix) or '.', exist_ok=True)
+        gc_lambda = write_trait_results(bim, n[:, j], beta[:, j], t[:, j], p[:, j], trait_prefix)
+        n_tested = np.count_nonzero(~np.isnan(p[:, j]))
+        print(f"{trait}: {n_tested} SNPs tested (genomic inflation lambda {gc_lambda:.4g}); "
+              f"results saved to {trait_prefix}.assoc.linear(.adjusted)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Linear SNP association of several phenotypes on a PLINK binary fileset.')
+    parser.add_argument('bfile', type=str, help='Prefix of the .bed/.bim/.fam files')
+    parser.add_argument('phenotype_path', type=str, help="Phenotype table ('sample id', 'fam', 'sex' and trait columns)")
+    parser.add_argument('out_prefix', type=str, help="Output prefix; '{trait}' is replaced by each trait name")
+    parser.add_argument('--traits', type=str, nargs='+', help='Trait columns to test (default: all)')
+    parser.add_argument('--block_size', type=int, default=DEFAULT_BLOCK_SIZE, help='SNPs decoded per block')
+
+    args = parser.parse_args()
+    if (args.traits is None or len(args.traits) > 1) and '{trait}' not in args.out_prefix:
+        parser.error("out_prefix must contain '{trait}' unless a single trait is given with --traits")
+
+    main(args.bfile, args.phenotype_path, args.out_prefix, args.traits, args.block_size)
@@ -1,38 +1,90 @@
 #!/usr/bin/env python3
 
 import pandas as pd
+import numpy as np
 import argparse
 
-def read_and_merge_files(file1, file2):
-    # Read the files
-    df1 = pd.read_csv(file1, delim_whitespace=True)
-    df2 = pd.read_csv(file2, delim_whitespace=True)
-    
-    # Merge the files on CHR and SNP columns
-    merged_df = pd.merge(df1, df2, on=["CHR", "SNP"])
-    return merged_df
-
-def filter_and_save(merged_df, threshold, output_file):
-    # Filter rows where FDR_BH is less than the threshold
-    filtered_df = merged_df[merged_df['FDR_BH'] < threshold]
-    
+# Rows parsed per chunk of the association files
+CHUNK_ROWS = 1_000_000
+
+def read_chunks(path, columns, chunk_rows):
+    # Whitespace-delimited plink output, a few columns at a time
+    return pd.read_csv(path, sep=r'\s+', usecols=columns, dtype={'CHR': str, 'SNP': str}, chunksize=chunk_rows)
+
+def read_candidate_hits(adjusted_file, thresholds, top_k=0, chunk_rows=CHUNK_ROWS):
+    # Stream the .adjusted file, keeping only the rows below the loosest threshold of any criterion
+    # and the top_k SNPs by unadjusted p-value
+    criteria = {}
+    for column, value in thresholds:
+        criteria[column] = max(criteria.get(column, value), value)
+    columns = ['CHR', 'SNP', 'UNADJ'] + [column for column in criteria if column != 'UNADJ']
+
+    candidates, top = [], None
+    for chunk in read_chunks(adjusted_file, columns, chunk_rows):
+        below = np.zeros(len(chunk), dtype=bool)
+        for column, loosest in criteria.items():
+            below |= (chunk[column] < loosest).to_numpy()
+        candidates.append(chunk[below])
+        if top_k:
+            top = pd.concat([top, chunk.nsmallest(top_k, 'UNADJ')]).nsmallest(top_k, 'UNADJ')
+    return pd.concat(candidates, ignore_index=True), top
+
+def attach_positions(linear_file, hits, chunk_rows=CHUNK_ROWS):
+    # Stream the .assoc.linear file and join its positions onto the hits through a hash of their (CHR, SNP) keys
+    keys = pd.MultiIndex.from_frame(hits[['CHR', 'SNP']])
+    positions = []
+    for chunk in read_chunks(linear_file, ['CHR', 'SNP', 'BP'], chunk_rows):
+        positions.append(chunk[pd.MultiIndex.from_frame(chunk[['CHR', 'SNP']]).isin(keys)])
+    return pd.concat(positions, ignore_index=True).merge(hits, on=['CHR', 'SNP'])
+
+def save_hits(hits, column, threshold, output_file):
     # Select required columns and rename them
-    output_df = filtered_df[['SNP', 'CHR', 'BP']]
+    output_df = hits.loc[hits[column] < threshold, ['SNP', 'CHR', 'BP']]
     output_df.columns = ['SNP reference', 'CHR', 'BP']
-    
-    # Save to a file
     output_df.to_csv(output_file, sep='\t', index=False)
 
+def parse_threshold(text):
+    column, _, value = text.partition('=')
+    return column, float(value)
+
 def main():
     parser = argparse.ArgumentParser(description="Filter GWAS results based on FDR_BH threshold.")
     parser.add_argument('file1', type=str, help="Path to assoc_results.assoc.linear")
     parser.add_argument('file2', type=str, help="Path to assoc_results.assoc.linear.adjusted")
     parser.add_argument('threshold', type=float, help="FDR_BH threshold value")
     parser.add_argument('output', type=str, help="Output file path")
+    parser.add_argument('--thresholds', type=parse_threshold, nargs='+', default=[], metavar='COLUMN=VALUE',
+                        help="Further thresholds on .adjusted columns, e.g. FDR_BH=0.01 BONF=0.05, saved to --hits_output")
+    parser.add_argument('--hits_output', type=str, help="Path to save the hits of every --thresholds entry as one long table")
+    parser.add_argument('--top_k', type=int, default=0, help="Number of SNPs with the smallest unadjusted p-value to list")
+    parser.add_argument('--top_output', type=str, help="Path to save the --top_k list")
+    parser.add_argument('--chunk_rows', type=int, default=CHUNK_ROWS, help="Rows parsed per chunk")
     args = parser.parse_args()
+    if bool(args.thresholds) != bool(args.hits_output):
+        parser.error("--thresholds and --hits_output must be given together")
+    if bool(args.top_k) != bool(args.top_output):
+        parser.error("--top_k and --top_output must be given together")
+
+    # One pass over each file serves every threshold and the top-k list
+    thresholds = [('FDR_BH', args.threshold)] + args.thresholds
+    candidates, top = read_candidate_hits(args.file2, thresholds, args.top_k, args.chunk_rows)
+    if top is not None:
+        candidates = pd.concat([candidates, top]).drop_duplicates(subset=['CHR', 'SNP'])
+    hits = attach_positions(args.file1, candidates, args.chunk_rows)
+
+    # Rows where FDR_BH is less than the threshold
+    save_hits(hits, 'FDR_BH', args.threshold, args.output)
+
+    if args.hits_output:
+        hits_df = pd.concat([hits.loc[hits[column] < value, ['SNP', 'CHR', 'BP', column]]
+                                 .rename(columns={'SNP': 'SNP reference', column: 'Value'})
+                                 .assign(Criterion=column, Threshold=value)
+                             for column, value in args.thresholds], ignore_index=True)
+        hits_df[['SNP reference', 'CHR', 'BP', 'Criterion', 'Threshold', 'Value']].to_csv(args.hits_output, sep='\t', index=False)
 
-    merged_df = read_and_merge_files(args.file1, args.file2)
-    filter_and_save(merged_df, args.threshold, args.output)
+    if args.top_output:
+        top_df = top.merge(hits[['CHR', 'SNP', 'BP']], on=['CHR', 'SNP'], how='left').rename(columns={'SNP': 'SNP reference'})
+        top_df[['SNP reference', 'CHR', 'BP'] + list(top.columns[2:])].to_csv(args.top_output, sep='\t', index=False)
 
 if __name__ == "__main__":
     main()
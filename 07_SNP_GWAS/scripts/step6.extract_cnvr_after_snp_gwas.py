@@ -1,68 +1,106 @@
 #!/usr/bin/env python3
 
 import pandas as pd
+import numpy as np
 import argparse
-import sys
+from genotype_schema import encode_chr
+from interval_index import build_index, overlap_pairs, nearest_interval
 
-def main(snp_path, cnvr_final_path, output_path, phenotype):
-    try:
-        # Read input files
-        snp_df = pd.read_csv(snp_path, sep='\t')
-        cnvr_final_df = pd.read_csv(cnvr_final_path, sep='\t')
+def read_marker_map(bim_path):
+    # Marker positions sorted per chromosome, from a PLINK .bim file
+    bim = pd.read_csv(bim_path, sep=r'\s+', header=None, usecols=[0, 3], names=['CHR', 'BP'], dtype={0: str})
+    bim['CHR'] = encode_chr(bim['CHR'])
+    return {code: np.sort(group['BP'].to_numpy(dtype=np.int64)) for code, group in bim.groupby('CHR')}
 
-        # Initialize result list and a dictionary to count SNPs per CNVR
-        results = []
-        cnvr_snp_counts = {}
+def snp_windows(chrom, position, window, window_unit, marker_map=None):
+    # [low, high] window around each SNP: +-window bp, or reaching window markers of the map on each side
+    position = np.asarray(position, dtype=np.int64)
+    if window_unit == 'bp':
+        return position - window, position + window
 
-        # Match SNP data with cnvr_final data
-        for _, snp_row in snp_df.iterrows():
-            chr = snp_row['CHR']
-            bp = snp_row['BP']
+    low, high = position.copy(), position.copy()
+    for code, positions in marker_map.items():
+        rows = np.flatnonzero(chrom == code)
+        # Marker slots reached on each side; a window running past the last marker of the chromosome
+        # on the left (or before the first on the right) leaves that side at the SNP itself
+        left = np.searchsorted(positions, position[rows], side='left') - window
+        right = np.searchsorted(positions, position[rows], side='right') - 1 + window
+        low[rows] = np.where(left < len(positions), np.minimum(positions[np.clip(left, 0, len(positions) - 1)], position[rows]),
+                             position[rows])
+        high[rows] = np.where(right >= 0, np.maximum(positions[np.clip(right, 0, len(positions) - 1)], position[rows]),
+                              position[rows])
+    return low, high
 
-            matched_cnvr_rows = cnvr_final_df[
-                (cnvr_final_df['chr'] == chr) & 
-                (cnvr_final_df['posStart'] <= bp) & 
-                (cnvr_final_df['posEnd'] >= bp)
-            ]
+def annotate_snps(snp_df, cnvr_final_df, cnvr_index, chrom, window=0, window_unit='bp', marker_map=None):
+    # CNVRs overlapping the window of every SNP (all traits at once)
+    low, high = snp_windows(chrom, snp_df['BP'], window, window_unit, marker_map)
 
-            for _, cnvr_row in matched_cnvr_rows.iterrows():
-                cnvr_id = cnvr_row['CNVR_ID']
-                
-                # Update the count of SNPs for this CNVR
-                if cnvr_id not in cnvr_snp_counts:
-                    cnvr_snp_counts[cnvr_id] = 0
-                cnvr_snp_counts[cnvr_id] += 1
+    # Match SNP data with cnvr_final data: one indexed join of the SNP windows
+    snp_rows, cnvr_rows = overlap_pairs(cnvr_index, chrom, low, high)
+    matched_cnvr_rows = cnvr_final_df.iloc[cnvr_rows]
+    results = pd.DataFrame({
+        'CNVR_ID': matched_cnvr_rows['CNVR_ID'].to_numpy(),
+        'Trait': snp_df['Trait'].to_numpy()[snp_rows],
+        'CHR': matched_cnvr_rows['chr'].to_numpy(),
+        'BP1': matched_cnvr_rows['posStart'].to_numpy(),
+        'BP2': matched_cnvr_rows['posEnd'].to_numpy(),
+        'First_marker_in_the_window': matched_cnvr_rows['start_snp'].to_numpy(),
+        'Last_marker_in_the_window': matched_cnvr_rows['end_snp'].to_numpy()
+    })
 
-                result = {
-                    'CNVR_ID': cnvr_row['CNVR_ID'],
-                    'Trait': phenotype,  # Use the phenotype provided by the user
-                    'CHR': cnvr_row['chr'],
-                    'BP1': cnvr_row['posStart'],
-                    'BP2': cnvr_row['posEnd'],
-                    'First_marker_in_the_window': cnvr_row['start_snp'],
-                    'Last_marker_in_the_window': cnvr_row['end_snp']
-                }
-                results.append(result)
+    # Count the SNPs per CNVR and trait and keep unique CNVR_IDs per trait
+    snp_counts = results.groupby(['Trait', 'CNVR_ID'], sort=False)['CNVR_ID'].transform('size')
+    return results.assign(SNP_Count=snp_counts).drop_duplicates(subset=['Trait', 'CNVR_ID']).copy()
 
-        # Convert results to DataFrame
-        result_df = pd.DataFrame(results).drop_duplicates(subset=['CNVR_ID'])
+def nearest_cnvrs(snp_df, cnvr_final_df, cnvr_index, chrom):
+    # Nearest CNVR and its distance (0 inside a CNVR) for every SNP of the step3 hits ('SNP reference', 'CHR', 'BP')
+    nearest, distance = nearest_interval(cnvr_index, chrom, snp_df['BP'])
+    nearest_df = snp_df[['Trait', 'SNP reference', 'CHR', 'BP']].copy()
+    nearest_df['Nearest_CNVR_ID'] = np.where(nearest >= 0, cnvr_final_df['CNVR_ID'].to_numpy()[np.maximum(nearest, 0)], None)
+    nearest_df['Distance'] = pd.Series(distance, index=nearest_df.index).where(nearest >= 0).astype('Int64')
+    return nearest_df
 
-        # Add SNP count to the result DataFrame
-        result_df['SNP_Count'] = result_df['CNVR_ID'].map(cnvr_snp_counts)
+def main(traits, cnvr_final_path, output_path, window=0, window_unit='bp', marker_map_path=None, nearest_output_path=None):
+    # Read input files: cnvr_final once, and the SNP list of every trait
+    cnvr_final_df = pd.read_csv(cnvr_final_path, sep='\t')
+    snp_df = pd.concat([pd.read_csv(snp_path, sep='\t').assign(Trait=phenotype) for phenotype, snp_path in traits],
+                       ignore_index=True)
+    marker_map = read_marker_map(marker_map_path) if window_unit == 'markers' else None
 
-        # Output the result DataFrame
-        result_df.to_csv(output_path, sep='\t', index=False)
-        print(f"Results saved to {output_path}")
+    cnvr_index = build_index(encode_chr(cnvr_final_df['chr']), cnvr_final_df['posStart'], cnvr_final_df['posEnd'])
+    chrom = encode_chr(snp_df['CHR'])
 
-    except Exception as e:
-        print(f"An error occurred: {e}", file=sys.stderr)
+    # Output the result DataFrame
+    result_df = annotate_snps(snp_df, cnvr_final_df, cnvr_index, chrom, window, window_unit, marker_map)
+    result_df.to_csv(output_path, sep='\t', index=False)
+    print(f"Results saved to {output_path}")
+
+    if nearest_output_path:
+        nearest_cnvrs(snp_df, cnvr_final_df, cnvr_index, chrom).to_csv(nearest_output_path, sep='\t', index=False)
+        print(f"Nearest CNVR of each SNP saved to {nearest_output_path}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process SNP and cnvr_final files.')
-    parser.add_argument('snp_path', type=str, help='Path to the SNP file')
+    parser.add_argument('snp_path', type=str, nargs='?', help='Path to the SNP file')
     parser.add_argument('cnvr_final_path', type=str, help='Path to the cnvr_final file')
     parser.add_argument('output_path', type=str, help='Path to save the output file')
-    parser.add_argument('phenotype', type=str, help='Phenotype to include in the output')
+    parser.add_argument('phenotype', type=str, nargs='?', help='Phenotype to include in the output')
+    parser.add_argument('--trait', nargs=2, action='append', default=[], metavar=('PHENOTYPE', 'SNP_PATH'),
+                        help='Further trait and its SNP file, annotated in the same run and output (repeatable)')
+    parser.add_argument('--window', type=int, default=0,
+                        help='Also match CNVRs within this distance of each SNP (default 0: SNPs inside CNVRs only)')
+    parser.add_argument('--window_unit', choices=['bp', 'markers'], default='bp',
+                        help='Unit of --window: base pairs, or markers of --marker_map on each side')
+    parser.add_argument('--marker_map', type=str, help='PLINK .bim file giving the marker positions for --window_unit markers')
+    parser.add_argument('--nearest_output', type=str, help='Path to save the nearest CNVR and its distance for every SNP')
 
     args = parser.parse_args()
-    main(args.snp_path, args.cnvr_final_path, args.output_path, args.phenotype)
+    if (args.snp_path is None) != (args.phenotype is None):
+        parser.error("snp_path and phenotype must be given together")
+    if args.window_unit == 'markers' and not args.marker_map:
+        parser.error("--marker_map is required with --window_unit markers")
+
+    traits = ([(args.phenotype, args.snp_path)] if args.snp_path else []) + args.trait
+    if not traits:
+        parser.error("no SNP file given")
+    main(traits, args.cnvr_final_path, args.output_path, args.window, args.window_unit, args.marker_map, args.nearest_output)
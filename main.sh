@@ -51,6 +51,9 @@ if (!require('GALLO', character.only = TRUE, quietly = TRUE)) {
 PY_LIB_PATH="/exports/cmvm/eddie/eb/groups/PocrnicLab/2024_ms_cnv/02_Tools_and_Computational_Environment/py_libs/"
 export PYTHONPATH="${PY_LIB_PATH}:$PYTHONPATH"
 
+# Shared Python modules used by the pipeline scripts
+export PYTHONPATH="${PIPELINE}/00_Common/scripts:$PYTHONPATH"
+
 # Required packages
 REQUIRED_PKG=("pandas" "matplotlib" "seaborn" "scipy" "numpy" "statsmodels")
 
@@ -75,7 +78,9 @@ mkdir -p ${PIPELINE}/01_Data/results/
 python ${PIPELINE}/01_Data/scripts/step1.update_snp_map_to_3.1.py \
 ${PIPELINE}/01_Data/data/SNPchimp_result_2721813773.tsv \
 ${SNPMAP} \
-${PIPELINE}/01_Data/results/new_snp_map_16022022_Ovine50K_4.txt
+${PIPELINE}/01_Data/results/new_snp_map_16022022_Ovine50K_4.txt \
+--save_index ${PIPELINE}/01_Data/results/SNPchimp_remap_index.npz \
+--counts_file ${PIPELINE}/01_Data/results/remap_counts_16022022_Ovine50K_4.txt
 
 #====================================================================================================
 # update final report
@@ -84,15 +89,20 @@ ${PIPELINE}/01_Data/results/new_snp_map_16022022_Ovine50K_4.txt \
 ${FINALREPORT} \
 ${PIPELINE}/01_Data/results/new_final_report_16022022_Ovine50K_4.txt
 
+#====================================================================================================
+# convert the updated final report into a columnar cache read by the later stages
+python ${PIPELINE}/00_Common/scripts/final_report_cache.py \
+${PIPELINE}/01_Data/results/new_final_report_16022022_Ovine50K_4.txt \
+${PIPELINE}/01_Data/results/new_final_report_16022022_Ovine50K_4.cache
+
 #****************************************PART2 Quality Control****************************************
 mkdir -p ${PIPELINE}/02_Quality_Control_by_Plink/results
 
-# generate files for plink
+# generate binary files for plink (use --ped_file/--map_file instead for text PED/MAP)
 python ${PIPELINE}/02_Quality_Control_by_Plink/scripts/step1.generate_ped_map.py \
-  --genotype_file "${PIPELINE}/01_Data/results/new_final_report_16022022_Ovine50K_4.txt" \
+  --genotype_file "${PIPELINE}/01_Data/results/new_final_report_16022022_Ovine50K_4.cache" \
   --snp_map_file "${PIPELINE}/01_Data/results/new_snp_map_16022022_Ovine50K_4.txt" \
-  --ped_file "${PIPELINE}/02_Quality_Control_by_Plink/results/input_data.ped" \
-  --map_file "${PIPELINE}/02_Quality_Control_by_Plink/results/input_data.map"
+  --bfile "${PIPELINE}/02_Quality_Control_by_Plink/results/input_data"
 
 #====================================================================================================
 # run plink
@@ -115,7 +125,7 @@ cp ${PIPELINE}/01_Data/data/centromere.txt ${WKDIR}/data/centromere.txt
 #====================================================================================================
 # generate final report files for ensembleCNV
 python ${PIPELINE}/03_Generate_Input_Files/scripts/step2.generate_final_report.py \
---report_path ${PIPELINE}/01_Data/results/new_final_report_16022022_Ovine50K_4.txt \
+--report_path ${PIPELINE}/01_Data/results/new_final_report_16022022_Ovine50K_4.cache \
 --map_path ${PIPELINE}/01_Data/results/new_snp_map_16022022_Ovine50K_4.txt \
 --output_path ${PIPELINE}/03_Generate_Input_Files/results/no_qc_final_report.txt \
 --missing_data_output_path ${PIPELINE}/03_Generate_Input_Files/results/missing_data_report.txt
@@ -126,7 +136,8 @@ python ${PIPELINE}/03_Generate_Input_Files/scripts/step3.clean_final_report.py \
 --final_report_path ${PIPELINE}/03_Generate_Input_Files/results/no_qc_final_report.txt \
 --qc_individuals_path ${PIPELINE}/02_Quality_Control_by_Plink/results/plink_results/filtered_data_final_individuals.txt \
 --qc_snps_path ${PIPELINE}/02_Quality_Control_by_Plink/results/plink_results/filtered_data_final_snps.txt \
---output_path ${WKDIR}/data/final_report.txt
+--output_path ${WKDIR}/data/final_report.txt \
+--counts_prefix ${PIPELINE}/03_Generate_Input_Files/results/clean_final_report
 
 #====================================================================================================
 # generate samples table file for ensembleCNV
@@ -150,24 +161,26 @@ Rscript ${WKDIR}/01_initial_call/finalreport_to_matrix_LRR_and_BAF/transform_fro
 --input ${WKDIR}/01_initial_call/finalreport_to_matrix_LRR_and_BAF \
 --output ${WKDIR}/01_initial_call/finalreport_to_matrix_LRR_and_BAF/RDS \
 
+#### (3) Memory-mappable float32 .npy matrices of the same data, sliced by Python tools without loading a chromosome
+python ${WKDIR}/01_initial_call/finalreport_to_matrix_LRR_and_BAF/finalreport_matrix_LRR_BAF.py \
+${WKDIR}/data/final_report.txt \
+${WKDIR}/01_initial_call/finalreport_to_matrix_LRR_and_BAF/NPY
+
 ### Prepare data for individual CNV callers -----------------------------------
-#### PennCNV
-perl ${WKDIR}/01_initial_call/prepare_IPQ_input_file/finalreport_to_PennCNV.pl \
--prefix ${WKDIR}/01_initial_call/run_PennCNV/data/ \
--suffix .txt \
+#### PennCNV (per-sample signal files written in parallel, plus the file list for compile_pfb.pl)
+python ${WKDIR}/01_initial_call/prepare_IPQ_input_file/finalreport_to_PennCNV.py \
+${WKDIR}/data/final_report.txt \
+--prefix ${WKDIR}/01_initial_call/run_PennCNV/data/ \
+--suffix .txt \
 --tolerate \
-${WKDIR}/data/final_report.txt
+--workers 8 \
+--list_file ${WKDIR}/01_initial_call/run_PennCNV/data_aux/list_pfb.txt
 
 ## run_PennCNV ----------------------------------------------------------------
 
 #### (1) Prepare SNP.pfb
 #### compile pfb (population frequency of B allele) file
 
-if [ ! -f "${WKDIR}/01_initial_call/run_PennCNV/data_aux/list_pfb.txt" ]; then
-    touch "${WKDIR}/01_initial_call/run_PennCNV/data_aux/list_pfb.txt"
-fi
-find "${WKDIR}/01_initial_call/run_PennCNV/data" -type f -name "*.txt" > "${WKDIR}/01_initial_call/run_PennCNV/data_aux/list_pfb.txt"
-
 perl ${PENNCNV}/compile_pfb.pl \
 -snpposfile ${WKDIR}/01_initial_call/finalreport_to_matrix_LRR_and_BAF/SNP_pos.txt \
 -listfile ${WKDIR}/01_initial_call/run_PennCNV/data_aux/list_pfb.txt \
@@ -190,9 +203,13 @@ Rscript ${WKDIR}/01_initial_call/run_PennCNV/step.3.check.PennCNV.jobs.R \
 --hmm ${PENNCNV}/lib/hhall.hmm
 
 #### (4) Combine PennCNV results (.rawcnv and .log files) from each sample
-perl ${WKDIR}/01_initial_call/run_PennCNV/step.4.combine.PennCNV.res.pl \
+python ${WKDIR}/01_initial_call/run_PennCNV/step.4.combine.PennCNV.res.py \
 --in_dir ${WKDIR}/01_initial_call/run_PennCNV/results/res \
---out_dir ${WKDIR}/01_initial_call/run_PennCNV/results
+--out_dir ${WKDIR}/01_initial_call/run_PennCNV/results \
+--table_output ${WKDIR}/01_initial_call/run_PennCNV/results/CNV.PennCNV_formatted.txt \
+--qc_output ${WKDIR}/01_initial_call/run_PennCNV/results/CNV.PennCNV_log_qc.txt \
+--sample_pattern 'HR[0-9]+' \
+--workers 8
 
 #### (5) Merge closely adjacent CNVs and generate final results
 Rscript ${WKDIR}/01_initial_call/run_PennCNV/step.5.clean.PennCNV.res.R \
@@ -399,13 +416,14 @@ python ${WKDIR}/06_performance_assessment/step4.cnv_stats.py \
 ${WKDIR}/03_create_CNVR/cnv_create.txt \
 ${WKDIR}/06_performance_assessment/results/initial_cnv_statistics.csv
 
-# step5.encode cnvr
+# step5.encode cnvr (sparse sample x CNVR matrix; the long table is read by the step6 plots)
 python ${WKDIR}/06_performance_assessment/step5.encode_cnvr.py \
 ${WKDIR}/06_performance_assessment/results/final_cnvr_type.txt \
 ${WKDIR}/06_performance_assessment/results/final_cnv.txt \
 ${WKDIR}/06_performance_assessment/results/inconsistent_cnvr_samples.txt \
-${WKDIR}/06_performance_assessment/results/encoded_results.txt \
-${WKDIR}/06_performance_assessment/results/final_samples.txt
+${WKDIR}/06_performance_assessment/results/encoded_cnvr \
+${WKDIR}/06_performance_assessment/results/final_samples.txt \
+--long_output ${WKDIR}/06_performance_assessment/results/encoded_results.txt
 
 # step6.plot cnvr distribution
 Rscript ${WKDIR}/06_performance_assessment/step6.plot_cnvr_distribution.R \
@@ -453,15 +471,8 @@ run_cnv_gwas() {
   mkdir -p ${PIPELINE}/05_CNV_GWAS/results/${trait}
   cd ${PIPELINE}/05_CNV_GWAS/results/${trait}
 
-  # Extract phenotypes information
-  python ${PIPELINE}/05_CNV_GWAS/scripts/step1.extract_phenotypes_parityC.py \
-  ${PHENOTYPE} \
-  ${PIPELINE}/05_CNV_GWAS/results/${trait}/phenotypes.txt \
-  ${trait} \
-  ${WKDIR}/06_performance_assessment/results/final_samples.txt
-
   # Extract rawcnv
-  bash ${PIPELINE}/05_CNV_GWAS/scripts/step2.extract_cnv_from_rawcnv.sh \
+  python ${PIPELINE}/05_CNV_GWAS/scripts/step2.extract_cnv_from_rawcnv.py \
   ${WKDIR}/01_initial_call/run_PennCNV/results/CNV.PennCNV.rawcnv \
   ${PIPELINE}/05_CNV_GWAS/results/${trait}/all_formatted_cnv.txt
 
@@ -491,11 +502,35 @@ run_cnv_gwas() {
   ${PIPELINE}/05_CNV_GWAS/results/${trait}/segs_pvalue_gr_corrected.txt
 }
 
+# Extract phenotypes information of milk, fat, and prot in one pass
+for trait in milk fat prot; do
+  mkdir -p ${PIPELINE}/05_CNV_GWAS/results/${trait}
+done
+python ${PIPELINE}/05_CNV_GWAS/scripts/step1.extract_phenotypes_parityC.py \
+${PHENOTYPE} \
+${PIPELINE}/05_CNV_GWAS/results/{trait}/phenotypes.txt \
+milk,fat,prot \
+${WKDIR}/06_performance_assessment/results/final_samples.txt
+
 # Run CNV-GWAS for milk, fat, and prot
 for trait in milk fat prot; do
   run_cnv_gwas $trait
 done
 
+# CNVR association of all traits at once on the encoded CNVR matrix (results readable by 06 step1)
+python ${PIPELINE}/05_CNV_GWAS/scripts/step1.extract_phenotypes_parityC.py \
+${PHENOTYPE} \
+${PIPELINE}/05_CNV_GWAS/results/phenotypes_all_traits.txt \
+milk,fat,prot \
+${WKDIR}/06_performance_assessment/results/final_samples.txt \
+--wide
+
+python ${PIPELINE}/05_CNV_GWAS/scripts/step6a.cnvr_association.py \
+${WKDIR}/06_performance_assessment/results/encoded_cnvr \
+${PIPELINE}/05_CNV_GWAS/results/phenotypes_all_traits.txt \
+${WKDIR}/06_performance_assessment/results/final_cnvr_type.txt \
+${PIPELINE}/05_CNV_GWAS/results/cnvr_association_all_traits.txt
+
 # Run phenotype statistic
 python ${PIPELINE}/05_CNV_GWAS/scripts/step7.phenotype_statistic.py \
 ${PHENOTYPE} \
@@ -554,15 +589,6 @@ run_snp_gwas() {
 
   cd ${PIPELINE}/07_SNP_GWAS/results/${trait}
 
-  cp ${PIPELINE}/02_Quality_Control_by_Plink/results/plink_results/filtered_data_final.* \
-    ${PIPELINE}/07_SNP_GWAS/results/${trait}
-
-  python ${PIPELINE}/07_SNP_GWAS/scripts/step1.update_fam_with_phenotype.py \
-    ${PIPELINE}/07_SNP_GWAS/results/${trait}/filtered_data_final.fam \
-    ${PIPELINE}/05_CNV_GWAS/results/${trait}/phenotypes.txt
-
-  bash ${PIPELINE}/07_SNP_GWAS/scripts/step2.snp_gwas.sh
-  
   Rscript ${PIPELINE}/07_SNP_GWAS/scripts/step2a.plot_manhattan.R \
   ${PIPELINE}/07_SNP_GWAS/results/${trait}/assoc_results.assoc.linear \
   ${PIPELINE}/07_SNP_GWAS/results/${trait}/assoc_results.assoc.linear.adjusted \
@@ -611,6 +637,13 @@ filter_snps_and_run_gallo() {
   ${PIPELINE}/07_SNP_GWAS/results/${trait}/go_kegg_info.csv
 }
 
+## Run SNP-GWAS of all traits in one pass on the QC'd PLINK files =============================================================
+python ${PIPELINE}/07_SNP_GWAS/scripts/step2.snp_gwas.py \
+  ${PIPELINE}/02_Quality_Control_by_Plink/results/plink_results/filtered_data_final \
+  ${PIPELINE}/05_CNV_GWAS/results/phenotypes_all_traits.txt \
+  ${PIPELINE}/07_SNP_GWAS/results/{trait}/assoc_results \
+  --traits milk fat prot
+
 ## Run SNP-GWAS and subsequent steps for each trait =============================================================
 for trait in milk fat prot; do
   run_snp_gwas $trait